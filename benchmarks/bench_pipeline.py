@@ -0,0 +1,425 @@
+"""Offline latency / throughput benchmark of ingestion, routing, retrieval and answering.
+
+Runs the app's own code paths from rag_database_routing against
+deterministic stand-ins: hashed bag-of-words embeddings, a canned chat model
+and a LocalVectorStore per entry in COLLECTIONS, so neither OpenAI nor Qdrant
+is needed. A synthetic PDF corpus is generated for every collection.
+
+    python benchmarks/bench_pipeline.py --docs 20 --pages 4 --queries 50 --output results.json
+    python benchmarks/bench_pipeline.py --embed-latency-ms 40 --llm-latency-ms 300
+    python benchmarks/bench_pipeline.py --output new.json --compare results.json
+
+Every stage (parse, split, embed, upsert, route, retrieve, answer) reports
+throughput and p50/p95/p99 latency. The end-to-end upload path through
+ingest_files() and the routing accuracy are reported as well. Fake
+embeddings score lower than real ones, so --confidence-threshold replaces
+the app's routing threshold for the run.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import streamlit as st
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from storage_profiles import FULL_DIMENSIONS  # noqa: E402
+
+STAGES = ["parse", "split", "embed", "upsert", "route", "retrieve", "answer"]
+FILLER_WORDS = ("the and for with this that from are was has have will can our your "
+                "about more most also into over after before each other some such").split()
+
+
+class BenchSessionState(dict):
+    """Stands in for st.session_state, which is always empty without `streamlit run`"""
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings: every token adds ±1 to a hashed dimension.
+
+    Texts sharing words get similar vectors, so routing and retrieval behave
+    sensibly. `latency` seconds are slept per call to mimic a remote API.
+    """
+
+    def __init__(self, dim: int = FULL_DIMENSIONS, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[h % self.dim] += 1.0 if h >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class CannedChatModel(BaseChatModel):
+    """Chat model that answers every prompt with the same text after `latency` seconds"""
+
+    answer: str = "This is a canned benchmark answer based on the provided context."
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "canned-benchmark"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+
+class UploadedPDF:
+    """The parts of Streamlit's UploadedFile that ingest_files() uses"""
+
+    def __init__(self, name: str, data: bytes):
+        self.name = name
+        self._data = data
+
+    def getvalue(self) -> bytes:
+        return self._data
+
+
+def make_pdf(pages: List[str], line_chars: int = 90) -> bytes:
+    """Minimal single-font PDF with one text page per entry in pages"""
+    def escape(line: str) -> str:
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects: List[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>", b"",
+                            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        lines = textwrap.wrap(text, line_chars)
+        content = ("BT /F1 9 Tf 11 TL 40 800 Td "
+                   + " ".join(f"({escape(line)}) '" for line in lines) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>".encode())
+        kids.append(len(objects))
+    objects[1] = (f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] "
+                  f"/Count {len(kids)} >>").encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def domain_vocabulary(db_type: str, config, size: int = 40) -> List[str]:
+    """Topic words of a collection: its description words plus synthetic terms"""
+    words = [word for word in re.findall(r"[a-z]+", config.description.lower()) if len(word) > 3]
+    return words + [f"{db_type[:4]}{i:02d}" for i in range(size)]
+
+
+def sentence(rng: random.Random, vocabulary: List[str], words: int, topical: float) -> str:
+    return " ".join(rng.choice(vocabulary) if rng.random() < topical else rng.choice(FILLER_WORDS)
+                    for _ in range(words)).capitalize() + "."
+
+
+def synthetic_corpus(collections, docs: int, pages: int, page_chars: int, seed: int) -> Dict[str, List[UploadedPDF]]:
+    rng = random.Random(seed)
+    corpus = {}
+    for db_type, config in collections.items():
+        vocabulary = domain_vocabulary(db_type, config)
+        files = []
+        for d in range(docs):
+            page_texts = []
+            for _ in range(pages):
+                text = ""
+                while len(text) < page_chars:
+                    text += sentence(rng, vocabulary, rng.randint(8, 16), topical=0.8) + " "
+                page_texts.append(text.strip())
+            files.append(UploadedPDF(f"{db_type}_{d:04d}.pdf", make_pdf(page_texts)))
+        corpus[db_type] = files
+    return corpus
+
+
+def synthetic_queries(collections, queries: int, seed: int) -> List[tuple]:
+    rng = random.Random(seed + 1)
+    vocabularies = {db_type: domain_vocabulary(db_type, config) for db_type, config in collections.items()}
+    labels = list(collections)
+    return [(label, sentence(rng, vocabularies[label], rng.randint(5, 10), topical=0.9).rstrip(".") + "?")
+            for label in (labels[i % len(labels)] for i in range(queries))]
+
+
+class StageTimer:
+    """Per-stage latency samples and processed item counts"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.items: Dict[str, int] = defaultdict(int)
+
+    def time(self, stage: str, fn, *args, items=None, **kwargs):
+        """Call fn, record its latency under stage and return its result.
+
+        items is the number of items processed, or a function of the result.
+        """
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.samples[stage].append(time.perf_counter() - started)
+        self.items[stage] += items(result) if callable(items) else (items or 1)
+        return result
+
+    def report(self) -> Dict[str, dict]:
+        report = {}
+        for stage in STAGES:
+            samples = self.samples.get(stage)
+            if not samples:
+                continue
+            total = sum(samples)
+            latencies = np.array(samples) * 1000
+            report[stage] = {
+                "calls": len(samples),
+                "items": self.items[stage],
+                "total_seconds": round(total, 4),
+                "throughput_per_second": round(self.items[stage] / total, 2) if total else None,
+                "mean_ms": round(float(latencies.mean()), 3),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            }
+        return report
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def setup_app(args):
+    """Import the app against fake models and local stores in a scratch directory"""
+    st.session_state = BenchSessionState()
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    os.chdir(workdir)  # PERSIST_DIRECTORY and the per-store state files are relative
+
+    import rag_database_routing as app
+    from vector_stores import DomainView, LocalVectorStore
+
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+    if args.confidence_threshold is not None:
+        app.CONFIDENCE_THRESHOLD = args.confidence_threshold
+
+    embeddings = HashingEmbeddings(latency=args.embed_latency_ms / 1000)
+
+    def open_store(config):
+        return LocalVectorStore(os.path.join(app.LOCAL_STORE_DIRECTORY, config.collection_name),
+                                embeddings, config.profile.dimensions)
+
+    if args.layout == "shared":
+        shared = open_store(app.SHARED_COLLECTION)
+        databases = {db_type: DomainView(shared, db_type) for db_type in app.COLLECTIONS}
+    else:
+        databases = {db_type: open_store(config) for db_type, config in app.COLLECTIONS.items()}
+
+    st.session_state.update(
+        openai_api_key="offline-benchmark",
+        vector_backend="local",
+        collection_layout=args.layout,
+        stream_answers=False,
+        embeddings=embeddings,
+        llm=CannedChatModel(latency=args.llm_latency_ms / 1000),
+        databases=databases,
+    )
+    return app, workdir
+
+
+def bench_ingestion_stages(app, timer: StageTimer, corpus, batch_size: int):
+    """Parse, split, embed and upsert every file one stage at a time"""
+    from ingestion import CHUNK_OVERLAP, CHUNK_SIZE, file_hash
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders import PyPDFLoader
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    shared = st.session_state.collection_layout == "shared"
+    for db_type, files in corpus.items():
+        upsert = app._document_sink(db_type)
+        for file in files:
+            data = file.getvalue()
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+                tmp_file.write(data)
+            try:
+                pages = timer.time("parse", PyPDFLoader(tmp_file.name).load, items=len)
+            finally:
+                os.unlink(tmp_file.name)
+            for page in pages:
+                page.metadata.update(source=file.name, file_hash=file_hash(data))
+                if shared:
+                    page.metadata["domain"] = db_type
+            chunks = timer.time("split", splitter.split_documents, pages, items=len)
+            for i in range(0, len(chunks), batch_size):
+                batch = chunks[i:i + batch_size]
+                vectors = timer.time("embed", st.session_state.embeddings.embed_documents,
+                                     [doc.page_content for doc in batch], items=len)
+                timer.time("upsert", upsert, batch, vectors, items=len(batch))
+
+
+def bench_queries(app, timer: StageTimer, queries) -> Dict[str, Any]:
+    """Route, retrieve and answer every query, returning routing accuracy"""
+    correct = 0
+    unrouted = 0
+    for label, question in queries:
+        routing = timer.time("route", app.route_query, question)
+        if routing.db_type is None:
+            unrouted += 1
+        correct += routing.db_type == label
+        db_type = routing.db_type or label
+        db = st.session_state.databases[db_type]
+        docs = timer.time("retrieve", db.similarity_search_by_vector, routing.query_vector,
+                          k=app.RETRIEVAL_K)
+        timer.time("answer", app.query_database, db, question, relevant_docs=docs or None)
+    return {
+        "queries": len(queries),
+        "accuracy": round(correct / len(queries), 4) if queries else None,
+        "unrouted": unrouted,
+    }
+
+
+def bench_upload_path(app, corpus) -> Dict[str, Any]:
+    """End-to-end ingest_files() over fresh collections"""
+    for db_type in corpus:
+        app.reset_collection(db_type)
+    started = time.perf_counter()
+    totals = defaultdict(int)
+    errors = []
+    for db_type, files in corpus.items():
+        stats = app.ingest_files(db_type, files)
+        totals["files"] += len(stats.files)
+        totals["pages"] += stats.pages
+        totals["chunks"] += stats.chunks
+        totals["vectors"] += stats.vectors
+        errors += stats.errors
+    elapsed = time.perf_counter() - started
+    return {
+        **totals,
+        "elapsed_seconds": round(elapsed, 4),
+        "pages_per_second": round(totals["pages"] / elapsed, 2),
+        "chunks_per_second": round(totals["chunks"] / elapsed, 2),
+        "vectors_per_second": round(totals["vectors"] / elapsed, 2),
+        "errors": errors,
+    }
+
+
+def compare(results: dict, baseline: dict):
+    """Print p95 latency and throughput changes against a baseline results file"""
+    print(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'}:")
+    print(f"{'stage':<10}{'p95 base':>12}{'p95 now':>12}{'change':>10}")
+    for stage, now in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base:
+            continue
+        change = (now["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        print(f"{stage:<10}{base['p95_ms']:>10.2f}ms{now['p95_ms']:>10.2f}ms{change:>+10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=10, help="PDFs per collection")
+    parser.add_argument("--pages", type=int, default=4, help="pages per PDF")
+    parser.add_argument("--page-chars", type=int, default=1800, help="characters per page")
+    parser.add_argument("--queries", type=int, default=60)
+    parser.add_argument("--batch-size", type=int, default=50, help="chunks per embed/upsert batch")
+    parser.add_argument("--layout", choices=["separate", "shared"], default="separate")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated latency per embedding call")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency per chat call")
+    parser.add_argument("--confidence-threshold", type=float, default=0.3,
+                        help="routing threshold to use with the fake embeddings")
+    parser.add_argument("--skip-upload-path", action="store_true", help="do not run ingest_files() end to end")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    args = parser.parse_args()
+    # Resolve paths before setup_app() changes the working directory
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    app, workdir = setup_app(args)
+    corpus = synthetic_corpus(app.COLLECTIONS, args.docs, args.pages, args.page_chars, args.seed)
+    queries = synthetic_queries(app.COLLECTIONS, args.queries, args.seed)
+
+    timer = StageTimer()
+    bench_ingestion_stages(app, timer, corpus, args.batch_size)
+    routing = bench_queries(app, timer, queries)
+    upload_path = None if args.skip_upload_path else bench_upload_path(app, corpus)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "workdir": workdir,
+            "args": vars(args),
+        },
+        "stages": timer.report(),
+        "routing": routing,
+        "upload_path": upload_path,
+    }
+
+    print(f"{'stage':<10}{'calls':>7}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, row in results["stages"].items():
+        print(f"{stage:<10}{row['calls']:>7}{row['throughput_per_second']:>12.1f}"
+              f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+    print(f"routing accuracy {routing['accuracy']:.1%} ({routing['unrouted']} unrouted)")
+    if upload_path:
+        print(f"ingest_files: {upload_path['pages_per_second']:.1f} pages/s, "
+              f"{upload_path['vectors_per_second']:.1f} vectors/s, {len(upload_path['errors'])} errors")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    if baseline_path:
+        with open(baseline_path) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
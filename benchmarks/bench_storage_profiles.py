@@ -0,0 +1,134 @@
+"""Recall / latency / memory comparison of the collection storage profiles.
+
+Loads the same vectors into one Qdrant collection per profile in
+storage_profiles.STORAGE_PROFILES, then measures recall@k against exact
+full-dimension search, search latency percentiles and estimated memory.
+
+    python benchmarks/bench_storage_profiles.py --qdrant-url http://localhost:6333
+    python benchmarks/bench_storage_profiles.py --vectors embeddings.npy --output results.json
+
+Without --vectors, synthetic vectors with a decaying variance spectrum are
+used so that shortened profiles behave roughly like text-embedding-3
+embeddings; real embeddings give more trustworthy numbers. Quantization and
+HNSW settings only take effect on a Qdrant server, not in ":memory:" mode.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage_profiles import FULL_DIMENSIONS, STORAGE_PROFILES, project_vector  # noqa: E402
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    spectrum = 1 / np.sqrt(1 + np.arange(dim) / 64)
+    centers = rng.normal(size=(clusters, dim)) * spectrum
+    vectors = centers[rng.integers(clusters, size=n)] + 0.5 * rng.normal(size=(n, dim)) * spectrum
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def benchmark_profile(client: QdrantClient, profile, corpus: np.ndarray, queries: np.ndarray,
+                      truth: np.ndarray, k: int) -> dict:
+    name = f"bench_{profile.name}_{uuid.uuid4().hex[:8]}"
+    client.create_collection(
+        collection_name=name,
+        vectors_config=profile.vector_params(),
+        hnsw_config=profile.hnsw_config(),
+        quantization_config=profile.quantization_config()
+    )
+    try:
+        started = time.perf_counter()
+        for i in range(0, len(corpus), 256):
+            client.upsert(name, points=[
+                PointStruct(id=i + j, vector=project_vector(vector.tolist(), profile.dimensions))
+                for j, vector in enumerate(corpus[i:i + 256])
+            ], wait=True)
+        upsert_seconds = time.perf_counter() - started
+
+        latencies, recalls = [], []
+        search_params = profile.search_params()
+        for query, expected in zip(queries, truth):
+            vector = project_vector(query.tolist(), profile.dimensions)
+            started = time.perf_counter()
+            hits = client.query_points(name, query=vector, limit=k, search_params=search_params).points
+            latencies.append((time.perf_counter() - started) * 1000)
+            recalls.append(len({hit.id for hit in hits} & set(expected.tolist())) / k)
+
+        memory = profile.memory_per_vector()
+        return {
+            "profile": profile.name,
+            "dimensions": profile.dimensions,
+            "quantization": profile.quantization,
+            "on_disk": profile.on_disk,
+            f"recall@{k}": float(np.mean(recalls)),
+            "latency_ms_p50": percentile(latencies, 50),
+            "latency_ms_p95": percentile(latencies, 95),
+            "latency_ms_p99": percentile(latencies, 99),
+            "upsert_vectors_per_s": len(corpus) / upsert_seconds,
+            "ram_mb": memory["ram"] * len(corpus) / 1_048_576,
+            "disk_mb": memory["disk"] * len(corpus) / 1_048_576,
+        }
+    finally:
+        client.delete_collection(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qdrant-url", default=os.getenv("QDRANT_URL", ":memory:"))
+    parser.add_argument("--qdrant-api-key", default=os.getenv("QDRANT_API_KEY"))
+    parser.add_argument("--vectors", help=".npy file of full-size embeddings to use as corpus and queries")
+    parser.add_argument("--points", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--profiles", nargs="*", default=list(STORAGE_PROFILES))
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    if args.vectors:
+        data = np.load(args.vectors).astype(np.float32)
+        data /= np.linalg.norm(data, axis=1, keepdims=True)
+        rng.shuffle(data)
+        queries, corpus = data[:args.queries], data[args.queries:]
+    else:
+        corpus = synthetic_vectors(args.points, FULL_DIMENSIONS, 50, rng).astype(np.float32)
+        queries = synthetic_vectors(args.queries, FULL_DIMENSIONS, 50, rng).astype(np.float32)
+    truth = np.argsort(-(queries @ corpus.T), axis=1)[:, :args.k]
+
+    if args.qdrant_url == ":memory:":
+        print("Running against in-memory Qdrant: quantization and HNSW settings are ignored.", file=sys.stderr)
+        client = QdrantClient(location=":memory:")
+    else:
+        client = QdrantClient(url=args.qdrant_url, api_key=args.qdrant_api_key, timeout=60)
+
+    results = [
+        benchmark_profile(client, STORAGE_PROFILES[name], corpus, queries, truth, args.k)
+        for name in args.profiles
+    ]
+
+    header = f"{'profile':<10} {'dims':>5} {'recall':>7} {'p50 ms':>7} {'p95 ms':>7} {'RAM MB':>8} {'disk MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        print(f"{row['profile']:<10} {row['dimensions']:>5} {row[f'recall@{args.k}']:>7.3f} "
+              f"{row['latency_ms_p50']:>7.2f} {row['latency_ms_p95']:>7.2f} "
+              f"{row['ram_mb']:>8.1f} {row['disk_mb']:>8.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"points": len(corpus), "queries": len(queries), "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class CentroidRouter:
+    """Routes queries with one dot product against per-collection centroids.
+
+    Each collection keeps the running sum of its unit-normalized document
+    embeddings and a document count, so centroids can be updated incrementally
+    as documents are added. The normalized centroids live in a single float32
+    matrix and routing is a vectorized cosine similarity against it.
+
+    Vectors longer than `dim` are truncated before normalization, so
+    collections storing shortened text-embedding-3 vectors and full-size
+    query embeddings all map into the same routing space.
+    """
+
+    def __init__(self, labels: Sequence[str], dim: int):
+        self.labels = list(labels)
+        self.dim = dim
+        self._index = {label: i for i, label in enumerate(self.labels)}
+        self._sums = np.zeros((len(self.labels), dim), dtype=np.float64)
+        self._counts = np.zeros(len(self.labels), dtype=np.int64)
+        self._matrix = np.zeros((len(self.labels), dim), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def counts(self) -> Dict[str, int]:
+        """Number of documents folded into each centroid"""
+        return {label: int(self._counts[i]) for label, i in self._index.items()}
+
+    def _normalized(self, vectors: Iterable[Sequence[float]]) -> np.ndarray:
+        matrix = np.asarray(list(vectors), dtype=np.float64)
+        if not matrix.size:
+            return np.empty((0, self.dim))
+        matrix = matrix.reshape(len(matrix), -1)[:, :self.dim]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def add(self, label: str, vectors: Iterable[Sequence[float]]):
+        """Fold new document embeddings into the centroid of label"""
+        matrix = self._normalized(vectors)
+        if not len(matrix):
+            return
+        with self._lock:
+            i = self._index[label]
+            self._sums[i] += matrix.sum(axis=0)
+            self._counts[i] += len(matrix)
+            self._refresh(i)
+
+    def remove(self, label: str, vectors: Iterable[Sequence[float]]):
+        """Take deleted document embeddings back out of the centroid of label"""
+        matrix = self._normalized(vectors)
+        if not len(matrix):
+            return
+        with self._lock:
+            i = self._index[label]
+            self._sums[i] -= matrix.sum(axis=0)
+            self._counts[i] = max(0, self._counts[i] - len(matrix))
+            if not self._counts[i]:
+                self._sums[i] = 0
+            self._refresh(i)
+
+    def reset(self, label: str):
+        """Forget every document of label, e.g. after the collection was reset"""
+        with self._lock:
+            i = self._index[label]
+            self._sums[i] = 0
+            self._counts[i] = 0
+            self._refresh(i)
+
+    def _refresh(self, i: int):
+        norm = np.linalg.norm(self._sums[i])
+        self._matrix[i] = self._sums[i] / norm if norm else 0
+
+    def scores(self, query_vector: Sequence[float]) -> Dict[str, float]:
+        """Cosine similarity of the query to every non-empty centroid"""
+        query = np.asarray(query_vector, dtype=np.float32)[:self.dim]
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        similarities = self._matrix @ query
+        return {
+            label: float(similarities[i])
+            for label, i in self._index.items()
+            if self._counts[i]
+        }
+
+    def route(self, query_vector: Sequence[float]) -> Tuple[Optional[str], float, float]:
+        """Return (best label, best score, margin over the runner-up).
+
+        The label is None when no collection has documents yet. With a single
+        non-empty collection the margin equals its score.
+        """
+        scores = self.scores(query_vector)
+        if not scores:
+            return None, 0.0, 0.0
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_label, best_score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        return best_label, best_score, best_score - runner_up
+
+    def save(self, path: str):
+        """Persist sums and counts so centroids survive restarts"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            np.savez(path, labels=np.array(self.labels), sums=self._sums, counts=self._counts)
+
+    def load(self, path: str) -> List[str]:
+        """Load persisted state for known labels and return the labels restored"""
+        if not os.path.exists(path):
+            return []
+        restored = []
+        with np.load(path) as data:
+            if data["sums"].shape[1] != self.dim:
+                return []
+            with self._lock:
+                for j, label in enumerate(data["labels"].tolist()):
+                    if label in self._index:
+                        i = self._index[label]
+                        self._sums[i] = data["sums"][j]
+                        self._counts[i] = data["counts"][j]
+                        self._refresh(i)
+                        restored.append(label)
+        return restored
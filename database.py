@@ -1,21 +1,191 @@
 import psycopg2
+from psycopg2 import extensions, pool
 from psycopg2.extras import execute_values
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import json
 import streamlit as st
+from langchain_openai import OpenAIEmbeddings
+from tracing import span, traced
 
 load_dotenv()
 
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))  # Opened up front and kept open while idle
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # Seconds to wait for a free connection
+DB_HEALTH_CHECK_IDLE = 30.0  # Ping connections that were idle longer than this before handing them out
+HISTORY_PAGE_SIZE = 20
+HISTORY_SNIPPET_CHARS = 120
+SEARCH_HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=18, MinWords=6, StartSel={start}, StopSel={stop}"
+HISTORY_EMBEDDING_MODEL = "text-embedding-3-small"
+HISTORY_EMBEDDING_DIMENSIONS = 1536
+HISTORY_EMBEDDING_MAX_CHARS = 8000  # Well below the model's 8191 token input limit
+HNSW_EF_SEARCH = 64  # Candidates the HNSW index scan keeps; higher is slower but more exact
+# Lowercase, punctuation and whitespace runs collapsed to one space; matches research_queries.normalized_topic
+NORMALIZED_TOPIC_SQL = "btrim(regexp_replace(lower(%s), '[^[:alnum:]_]+', ' ', 'g'))"
+
+class PooledConnections:
+    """Process-wide pool of Postgres connections shared by all Streamlit sessions.
+
+    ThreadedConnectionPool raises as soon as it is exhausted, so a semaphore
+    makes callers wait up to `timeout` seconds for a free connection instead.
+    Connections are checked on checkout: closed or broken ones are replaced,
+    and ones idle for more than `health_check_idle` seconds are pinged.
+    Like any psycopg2 pool, idle connections beyond `minconn` are closed when
+    they are returned.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = DB_POOL_TIMEOUT,
+                 health_check_idle: float = DB_HEALTH_CHECK_IDLE, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_idle = health_check_idle
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {"checkouts": 0, "waits": 0, "wait_seconds": 0.0,
+                       "timeouts": 0, "health_check_failures": 0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0.0) > self.health_check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _checkout(self):
+        # Every unhealthy connection is closed, so after maxconn attempts
+        # the pool has to open a fresh one
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if self._healthy(conn):
+                return conn
+            self._count("health_check_failures")
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        raise pool.PoolError("Could not get a healthy database connection")
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commit on success, roll back on error, always return it"""
+        if not self._slots.acquire(blocking=False):
+            self._count("waits")
+            started = time.monotonic()
+            acquired = self._slots.acquire(timeout=self.timeout)
+            self._count("wait_seconds", time.monotonic() - started)
+            if not acquired:
+                self._count("timeouts")
+                raise pool.PoolError(f"No database connection free after {self.timeout:.0f}s "
+                                     f"(pool size {self.maxconn})")
+        try:
+            conn = self._checkout()
+            self._count("checkouts")
+            try:
+                with conn:
+                    yield conn
+            finally:
+                if conn.closed:
+                    self._last_used.pop(id(conn), None)
+                else:
+                    self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        in_use = len(self._pool._used)
+        stats.update(min=self.minconn, max=self.maxconn, in_use=in_use,
+                     open=in_use + len(self._pool._pool))
+        return stats
+
+    def close(self):
+        self._pool.closeall()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> PooledConnections:
+    """The process-wide connection pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PooledConnections(
+                DB_POOL_MIN,
+                DB_POOL_MAX,
+                dbname=os.getenv("DB_NAME"),
+                user=os.getenv("DB_USER"),
+                password=os.getenv("DB_PASSWORD"),
+                host=os.getenv("DB_HOST"),
+                port=os.getenv("DB_PORT")
+            )
+        return _pool
+
 def get_db_connection():
-    return psycopg2.connect(
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT")
-    )
+    """Pooled connection for a `with` block; committed on success, rolled back on error"""
+    return get_pool().connection()
 
+def get_pool_stats() -> dict:
+    return get_pool().stats()
+
+def _normalize_results(results):
+    if not isinstance(results, dict):
+        results = {
+            'final_content': str(results),
+            'raw_research': '',
+            'topic': ''
+        }
+    return results
+
+def _title(query_text, results):
+    """The topic, or the query when there is none, so full-text search covers it"""
+    return results.get('topic') or query_text
+
+@st.cache_resource(show_spinner=False)
+def get_history_embedder() -> OpenAIEmbeddings:
+    """Process-wide embeddings client for saved articles"""
+    return OpenAIEmbeddings(model=HISTORY_EMBEDDING_MODEL)
+
+def embed_texts(texts):
+    with span("embed_history", "embedding", texts=len(texts)):
+        return get_history_embedder().embed_documents(texts)
+
+def history_embedding_text(title, results):
+    """What an article is embedded as: its title and the start of its content"""
+    content = results.get('final_content', '') if isinstance(results, dict) else str(results)
+    return f"{title or ''}\n\n{content}"[:HISTORY_EMBEDDING_MAX_CHARS]
+
+def _vector_literal(embedding):
+    # pgvector's text input format, so no client-side adapter is needed
+    return None if embedding is None else "[" + ",".join(map(str, embedding)) + "]"
+
+def _unique_sources(sources):
+    """Sources with a URL, first occurrence of each URL only"""
+    unique = {}
+    for source in sources or []:
+        if source.get('url'):
+            unique.setdefault(source['url'], {'url': source['url'], 'title': source.get('title') or ''})
+    return list(unique.values())
+
+@traced("db.save_query", "db")
 def save_query_to_db(query_text):
     with get_db_connection() as conn:
         with conn.cursor() as cur:
@@ -25,18 +195,14 @@ def save_query_to_db(query_text):
             )
             return cur.fetchone()[0]
 
+@traced("db.save_results", "db")
 def save_results_to_db(query_id, results):
     """Save results as JSON in database"""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
             try:
                 # Ensure results is a dictionary
-                if not isinstance(results, dict):
-                    results = {
-                        'final_content': str(results),
-                        'raw_research': '',
-                        'topic': ''
-                    }
+                results = _normalize_results(results)
                 
                 # Save to database
                 cur.execute(
@@ -49,76 +215,394 @@ def save_results_to_db(query_id, results):
                 conn.rollback()
                 raise e
 
-def get_filtered_history(search_filter=None, start_date=None, end_date=None, sort_order="Newest First"):
-    """Get filtered history from database"""
+@traced("db.save_generated_content", "db")
+def save_generated_content(query_text, results, sources=None, embedding=None, topic_embedding=None):
+    """Save a query, its output and its sources atomically in one round-trip.
+
+    A data-modifying CTE inserts all rows in a single statement, so either
+    everything is stored or nothing is. `sources` is a list of dicts with
+    `url` and `title`; `embedding` and `topic_embedding` are the article's
+    and the query's embeddings, if already computed. Returns (query_id, output_id).
+    """
+    results = _normalize_results(results)
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            query = """
-                SELECT 
-                    rq.id,
-                    rq.query_text,
-                    rq.created_at,
-                    CASE 
-                        WHEN ro.content IS NULL THEN NULL
-                        ELSE ro.content::text
-                    END as content,
-                    ro.title
-                FROM research_queries rq
-                LEFT JOIN research_outputs ro ON rq.id = ro.query_id
-                WHERE 1=1
-            """
-            params = []
-            
-            if search_filter:
-                query += " AND (rq.query_text ILIKE %s OR ro.title ILIKE %s)"
-                search_term = f"%{search_filter}%"
-                params.extend([search_term, search_term])
-            
-            if start_date:
-                query += " AND rq.created_at::date >= %s"
-                params.append(start_date)
-            
-            if end_date:
-                query += " AND rq.created_at::date <= %s"
-                params.append(end_date)
-            
-            if sort_order == "Newest First":
-                query += " ORDER BY rq.created_at DESC"
-            elif sort_order == "Oldest First":
-                query += " ORDER BY rq.created_at ASC"
-            else:  # Relevance
-                if search_filter:
-                    query += " ORDER BY similarity(rq.query_text, %s) DESC"
-                    params.append(search_filter)
-                else:
-                    query += " ORDER BY rq.created_at DESC"
-            
-            query += " LIMIT 10"
-            
-            cur.execute(query, params)
+            cur.execute("""
+                WITH new_query AS (
+                    INSERT INTO research_queries (query_text, topic_embedding) VALUES (%s, %s::vector)
+                    RETURNING id
+                ), new_output AS (
+                    INSERT INTO research_outputs (query_id, title, content, embedding)
+                    SELECT id, %s, %s::jsonb, %s::vector FROM new_query
+                    RETURNING id, query_id
+                ), new_sources AS (
+                    INSERT INTO research_sources (output_id, url, title)
+                    SELECT new_output.id, src.url, src.title
+                    FROM new_output, jsonb_to_recordset(%s::jsonb) AS src(url text, title text)
+                )
+                SELECT query_id, id FROM new_output
+            """, (
+                query_text,
+                _vector_literal(topic_embedding),
+                _title(query_text, results),
+                json.dumps(results),
+                _vector_literal(embedding),
+                json.dumps(_unique_sources(sources))
+            ))
+            query_id, output_id = cur.fetchone()
+            return query_id, output_id
+
+@traced("db.save_generated_batch", "db")
+def save_generated_batch(items, embed=True):
+    """Save many (query_text, results, sources) triples in one transaction and round-trip.
+
+    IDs are drawn from the tables' sequences up front, so every output and
+    source can reference its query without matching RETURNING rows back to
+    the input. Returns a (query_id, output_id) pair per item, in input order.
+
+    With `embed`, article and topic embeddings for the whole batch are
+    computed in one embeddings call and saved with the rows, so semantic
+    history search and the generation cache see them. Without it, or if
+    embedding fails, articles are saved without vectors: run
+    backfill_embeddings afterwards for semantic search. Topic embeddings are
+    not backfilled, so such topics stay invisible to the generation cache's
+    similarity match.
+    """
+    prepared = []
+    for query_text, results, sources in items:
+        results = _normalize_results(results)
+        prepared.append((query_text, _title(query_text, results), results, sources))
+    if not prepared:
+        return []
+    
+    embeddings = topic_embeddings = [None] * len(prepared)
+    if embed:
+        try:
+            vectors = embed_texts([history_embedding_text(title, results) for _, title, results, _ in prepared]
+                                  + [query_text for query_text, _, _, _ in prepared])
+            embeddings, topic_embeddings = vectors[:len(prepared)], vectors[len(prepared):]
+        except Exception as e:
+            logging.getLogger(__name__).warning(
+                "Saving %d articles without embeddings, run backfill_embeddings for them: %s", len(prepared), e
+            )
+    
+    rows = [
+        (i, query_text, title, json.dumps(results), json.dumps(_unique_sources(sources)),
+         _vector_literal(embedding), _vector_literal(topic_embedding))
+        for i, ((query_text, title, results, sources), embedding, topic_embedding)
+        in enumerate(zip(prepared, embeddings, topic_embeddings))
+    ]
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            saved = execute_values(cur, """
+                WITH batch AS MATERIALIZED (
+                    SELECT
+                        v.ord::int AS ord,
+                        nextval(pg_get_serial_sequence('research_queries', 'id')) AS query_id,
+                        nextval(pg_get_serial_sequence('research_outputs', 'id')) AS output_id,
+                        v.query_text,
+                        v.title,
+                        v.content::jsonb AS content,
+                        v.sources::jsonb AS sources,
+                        v.embedding::vector AS embedding,
+                        v.topic_embedding::vector AS topic_embedding
+                    FROM (VALUES %s) AS v (ord, query_text, title, content, sources, embedding, topic_embedding)
+                ), new_queries AS (
+                    INSERT INTO research_queries (id, query_text, topic_embedding)
+                    SELECT query_id, query_text, topic_embedding FROM batch
+                ), new_outputs AS (
+                    INSERT INTO research_outputs (id, query_id, title, content, embedding)
+                    SELECT output_id, query_id, title, content, embedding FROM batch
+                ), new_sources AS (
+                    INSERT INTO research_sources (output_id, url, title)
+                    SELECT batch.output_id, src.url, src.title
+                    FROM batch, jsonb_to_recordset(batch.sources) AS src(url text, title text)
+                )
+                SELECT query_id, output_id FROM batch ORDER BY ord
+            """, rows, page_size=len(rows), fetch=True)
+            return [tuple(row) for row in saved]
+
+@traced("db.filtered_history", "db")
+def get_filtered_history(search_filter=None, start_date=None, end_date=None, sort_order="Newest First",
+                         cursor=None, limit=HISTORY_PAGE_SIZE):
+    """One page of history for the sidebar listing.
+
+    Rows are (id, query_text, title, created_at, snippet); the article itself
+    is loaded on demand with get_query_content. Pages are keyset-paginated on
+    (created_at, id): pass the returned cursor back to get the next page, it
+    is None on the last one. Relevance ordering returns a single page.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(*_history_query(search_filter, start_date, end_date, sort_order, cursor, limit))
+            rows = cur.fetchall()
+            if not _keyset_paginated(search_filter, sort_order) or len(rows) <= limit:
+                return rows[:limit], None
+            rows = rows[:limit]
+            return rows, (rows[-1][3], rows[-1][0])
+
+def _keyset_paginated(search_filter, sort_order):
+    return sort_order in ("Newest First", "Oldest First") or not search_filter
+
+def _history_query(search_filter, start_date, end_date, sort_order, cursor, limit):
+    """SQL and parameters of get_filtered_history, also EXPLAINed by `migrations.py --check`"""
+    query = """
+        SELECT 
+            rq.id,
+            rq.query_text,
+            ro.title,
+            rq.created_at,
+            ro.snippet
+        FROM research_queries rq
+        LEFT JOIN LATERAL (
+            SELECT title, left(content->>'final_content', %s) AS snippet
+            FROM research_outputs
+            WHERE query_id = rq.id
+            ORDER BY id DESC
+            LIMIT 1
+        ) ro ON true
+        WHERE 1=1
+    """
+    params = [HISTORY_SNIPPET_CHARS]
+    
+    if search_filter:
+        # Each branch can use its own trigram index, unlike an OR across the join
+        query += """ AND rq.id IN (
+            SELECT id FROM research_queries WHERE query_text ILIKE %s
+            UNION
+            SELECT query_id FROM research_outputs WHERE title ILIKE %s
+        )"""
+        search_term = f"%{search_filter}%"
+        params.extend([search_term, search_term])
+    
+    # Half-open range on the bare column, so the created_at index applies
+    if start_date:
+        query += " AND rq.created_at >= %s::date"
+        params.append(start_date)
+    
+    if end_date:
+        query += " AND rq.created_at < %s::date + 1"
+        params.append(end_date)
+    
+    if _keyset_paginated(search_filter, sort_order):
+        ascending = sort_order == "Oldest First"
+        if cursor:
+            query += f" AND (rq.created_at, rq.id) {'>' if ascending else '<'} (%s, %s)"
+            params.extend(cursor)
+        direction = "ASC" if ascending else "DESC"
+        query += f" ORDER BY rq.created_at {direction}, rq.id {direction}"
+    else:  # Relevance
+        query += " ORDER BY similarity(rq.query_text, %s) DESC, rq.id DESC"
+        params.append(search_filter)
+    
+    # One extra row tells whether there is a next page
+    query += " LIMIT %s"
+    params.append(limit + 1)
+    return query, params
+
+@traced("db.search_history", "db")
+def search_history(search_text, start_date=None, end_date=None, limit=HISTORY_PAGE_SIZE,
+                   start_sel="<mark>", stop_sel="</mark>"):
+    """Full-text search over article titles and content, best matches first.
+
+    Rows have the get_filtered_history shape (id, query_text, title,
+    created_at, snippet), where the snippet is a ts_headline excerpt of the
+    raw article text with matches wrapped in start_sel / stop_sel. It is not
+    HTML-escaped. Headlines are only built for the returned rows.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(*_search_history_query(search_text, start_date, end_date, limit, start_sel, stop_sel))
+            return cur.fetchall()
+
+def _search_history_query(search_text, start_date, end_date, limit, start_sel, stop_sel):
+    """SQL and parameters of search_history, also EXPLAINed by `migrations.py --check`"""
+    # The tsquery is spelled out rather than shared through a CTE, which the planner
+    # would materialize, leaving @@ a join filter that can't use the GIN index
+    query = """
+        WITH hits AS (
+            SELECT ro.id, ro.query_id, ro.title, ro.content,
+                   ts_rank(ro.search_vector, websearch_to_tsquery('english', %s)) AS rank
+            FROM research_outputs ro
+            JOIN research_queries rq ON rq.id = ro.query_id
+            WHERE ro.search_vector @@ websearch_to_tsquery('english', %s)
+    """
+    params = [search_text, search_text]
+    
+    if start_date:
+        query += " AND rq.created_at >= %s::date"
+        params.append(start_date)
+    
+    if end_date:
+        query += " AND rq.created_at < %s::date + 1"
+        params.append(end_date)
+    
+    query += """
+            ORDER BY rank DESC, ro.id DESC
+            LIMIT %s
+        )
+        SELECT
+            rq.id,
+            rq.query_text,
+            hits.title,
+            rq.created_at,
+            ts_headline('english', coalesce(hits.content->>'final_content', ''),
+                        websearch_to_tsquery('english', %s), %s)
+        FROM hits
+        JOIN research_queries rq ON rq.id = hits.query_id
+        ORDER BY hits.rank DESC, hits.id DESC
+    """
+    params.extend([limit, search_text, SEARCH_HEADLINE_OPTIONS.format(start=start_sel, stop=stop_sel)])
+    return query, params
+
+SEMANTIC_SEARCH_SQL = """
+    WITH nearest AS (
+        SELECT query_id, title, embedding <=> %s::vector AS distance
+        FROM research_outputs
+        WHERE embedding IS NOT NULL
+        ORDER BY distance
+        LIMIT %s
+    )
+    SELECT rq.id, rq.query_text, nearest.title, rq.created_at, 1 - nearest.distance
+    FROM nearest
+    JOIN research_queries rq ON rq.id = nearest.query_id
+    ORDER BY nearest.distance
+"""
+
+@traced("db.semantic_history_search", "vector_search")
+def semantic_history_search(text, k=5):
+    """The k saved articles closest in meaning to `text`, nearest first.
+
+    Rows are (id, query_text, title, created_at, similarity), with cosine
+    similarity in [-1, 1]. Articles without an embedding are not searched.
+    """
+    embedding = _vector_literal(embed_texts([text])[0])
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL hnsw.ef_search = %s", (max(HNSW_EF_SEARCH, k),))
+            cur.execute(SEMANTIC_SEARCH_SQL, (embedding, k))
             return cur.fetchall()
 
+RECENT_TOPIC_SQL = f"""
+    SELECT rq.id, rq.query_text, rq.created_at, ro.content, 1.0::float8
+    FROM research_queries rq
+    JOIN LATERAL (
+        SELECT content FROM research_outputs
+        WHERE query_id = rq.id
+        ORDER BY id DESC
+        LIMIT 1
+    ) ro ON true
+    WHERE rq.normalized_topic = {NORMALIZED_TOPIC_SQL}
+      AND rq.created_at >= now() - make_interval(secs => %s)
+    ORDER BY rq.created_at DESC
+    LIMIT 1
+"""
+
+@traced("db.find_recent_by_topic", "db")
+def find_recent_by_topic(topic, max_age_seconds):
+    """Newest article for the same normalized topic saved within max_age_seconds.
+
+    Returns (query_id, query_text, created_at, content, similarity) or None.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(RECENT_TOPIC_SQL, (topic, max_age_seconds))
+            return cur.fetchone()
+
+@traced("db.find_similar_recent_topic", "vector_search")
+def find_similar_recent_topic(topic_embedding, max_age_seconds, min_similarity):
+    """Most similar topic saved within max_age_seconds, if its cosine similarity reaches min_similarity.
+
+    Returns (query_id, query_text, created_at, content, similarity) or None.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                WITH recent AS MATERIALIZED (
+                    SELECT id, query_text, created_at, topic_embedding <=> %s::vector AS distance
+                    FROM research_queries
+                    WHERE created_at >= now() - make_interval(secs => %s)
+                      AND topic_embedding IS NOT NULL
+                ), best AS (
+                    SELECT * FROM recent WHERE distance <= 1 - %s ORDER BY distance LIMIT 1
+                )
+                SELECT best.id, best.query_text, best.created_at, ro.content, 1 - best.distance
+                FROM best
+                JOIN LATERAL (
+                    SELECT content FROM research_outputs
+                    WHERE query_id = best.id
+                    ORDER BY id DESC
+                    LIMIT 1
+                ) ro ON true
+            """, (_vector_literal(topic_embedding), max_age_seconds, min_similarity))
+            return cur.fetchone()
+
+def backfill_embeddings(batch_size=100, progress=None):
+    """Embed articles saved without an embedding, `batch_size` per API call and transaction.
+
+    Safe to stop and rerun: each batch is committed on its own. Returns the
+    number of articles embedded.
+    """
+    total = 0
+    last_id = 0
+    while True:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, title, content FROM research_outputs
+                    WHERE embedding IS NULL AND id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (last_id, batch_size))
+                batch = cur.fetchall()
+        if not batch:
+            return total
+        embeddings = embed_texts([history_embedding_text(title, content or {}) for _, title, content in batch])
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    UPDATE research_outputs ro SET embedding = v.embedding::vector
+                    FROM (VALUES %s) AS v (id, embedding)
+                    WHERE ro.id = v.id
+                """, [(output_id, _vector_literal(embedding))
+                      for (output_id, _, _), embedding in zip(batch, embeddings)], page_size=len(batch))
+        total += len(batch)
+        last_id = batch[-1][0]
+        if progress:
+            progress(f"Embedded {total} articles (up to id {last_id})")
+
+QUERY_CONTENT_SQL = """
+    SELECT 
+        ro.content,
+        ro.title,
+        COALESCE(
+            array_agg(json_build_object('url', rs.url, 'title', rs.title) ORDER BY rs.id)
+                FILTER (WHERE rs.id IS NOT NULL),
+            '{}'
+        ) as sources
+    FROM research_outputs ro
+    LEFT JOIN research_sources rs ON ro.id = rs.output_id
+    WHERE ro.query_id = %s
+    GROUP BY ro.id
+    ORDER BY ro.id DESC
+    LIMIT 1
+"""
+
+@traced("db.query_content", "db")
 def get_query_content(query_id):
     """Get content for a specific query"""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 
-                    ro.content,
-                    ro.title,
-                    array_agg(json_build_object('url', rs.url, 'title', rs.title)) as sources
-                FROM research_outputs ro
-                LEFT JOIN research_sources rs ON ro.id = rs.output_id
-                WHERE ro.query_id = %s
-                GROUP BY ro.id
-            """, (query_id,))
+            cur.execute(QUERY_CONTENT_SQL, (query_id,))
             return cur.fetchone()
 
 def test_db():
     try:
-        conn = get_db_connection()
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
         st.success("Database connection successful!")
-        conn.close()
+        st.json(get_pool_stats())
     except Exception as e:
         st.error(f"Database connection failed: {e}")
 
@@ -0,0 +1,122 @@
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from tracing import span
+
+
+@dataclass
+class GenerationHit:
+    query_id: int
+    query_text: str
+    created_at: datetime
+    content: Any
+    similarity: float
+    match: str  # "exact" for the same normalized topic, "semantic" for a similar one
+
+
+class GenerationCache:
+    """Reuse a recent article instead of generating one for a near-duplicate topic.
+
+    A topic first matches saved queries with the same normalized text, then,
+    through its embedding, saved queries with a cosine similarity of at least
+    `threshold`. Only articles younger than `freshness_seconds` are reused.
+    The articles themselves live in the database; this class holds the
+    lookup policy and the hit / time-saved statistics of the process.
+    """
+
+    def __init__(self, find_by_topic: Callable[[str, float], Optional[tuple]],
+                 find_similar: Callable[[Sequence[float], float, float], Optional[tuple]],
+                 embed: Callable[[List[str]], List[List[float]]],
+                 freshness_seconds: float = 24 * 3600, threshold: float = 0.9):
+        self.find_by_topic = find_by_topic
+        self.find_similar = find_similar
+        self.embed = embed
+        self.freshness_seconds = freshness_seconds
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.forced = 0
+        self.errors = 0  # Lookups in which a query or the embedding failed
+        self.lookup_seconds = 0.0  # Spent on lookups that hit
+        self.generations = 0
+        self.generation_seconds = 0.0
+
+    def _count(self, name: str, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def lookup(self, topic: str) -> Tuple[Optional[GenerationHit], Optional[List[float]]]:
+        """Return a fresh matching article, if any, and the topic embedding.
+
+        The embedding is only computed when the exact match misses; it is
+        returned so that a new article can be saved with it. It is None when
+        embedding failed, in which case only exact matches are found.
+
+        A lookup never raises: a failing query (e.g. before the generation
+        cache migration is applied) counts as a miss and is recorded on the span.
+        """
+        started = time.perf_counter()
+        hit, embedding = None, None
+        with span("generation_cache_lookup", "cache") as lookup:
+            try:
+                row = self.find_by_topic(topic, self.freshness_seconds)
+            except Exception as e:
+                row = None
+                lookup.attrs["exact_error"] = f"{type(e).__name__}: {e}"
+            if row:
+                hit = GenerationHit(*row, match="exact")
+            else:
+                try:
+                    embedding = self.embed([topic])[0]
+                except Exception as e:
+                    lookup.attrs["embed_error"] = f"{type(e).__name__}: {e}"
+                if embedding is not None:
+                    try:
+                        row = self.find_similar(embedding, self.freshness_seconds, self.threshold)
+                    except Exception as e:
+                        row = None
+                        lookup.attrs["similar_error"] = f"{type(e).__name__}: {e}"
+                    if row:
+                        hit = GenerationHit(*row, match="semantic")
+            lookup.attrs["hit"] = hit.match if hit else "miss"
+        if any(key.endswith("_error") for key in lookup.attrs):
+            self._count("errors")
+        if hit:
+            self._count("exact_hits" if hit.match == "exact" else "semantic_hits")
+            self._count("lookup_seconds", time.perf_counter() - started)
+        else:
+            self._count("misses")
+        return hit, embedding
+
+    def record_generation(self, seconds: float):
+        """Time of a full generation, used to estimate the time a hit saves"""
+        with self._lock:
+            self.generations += 1
+            self.generation_seconds += seconds
+
+    def record_forced(self):
+        self._count("forced")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            average = self.generation_seconds / self.generations if self.generations else 0.0
+            return {
+                "lookups": lookups,
+                "hits": hits,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "forced": self.forced,
+                "errors": self.errors,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "avg_generation_seconds": average,
+                # Unknown (0) until a generation has been timed in this process
+                "time_saved_seconds": max(hits * average - self.lookup_seconds, 0.0),
+            }
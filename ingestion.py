@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import PyPDFLoader
+
+CHUNK_SIZE = 500  # Chunk boyutunu küçült
+CHUNK_OVERLAP = 50  # Overlap'i azalt
+
+_DONE = object()  # Queue sentinel marking the end of a stage
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c3a52-9e0b-4d55-8a43-2b7c0e4f9d11")
+
+
+def file_hash(data: bytes) -> str:
+    """Content hash identifying an uploaded file"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def chunk_id(document: Document) -> str:
+    """Deterministic point ID derived from a chunk's source and content.
+
+    In a shared collection the chunk's `domain` is part of the source, so the
+    same file can be indexed under several domains.
+    """
+    source = document.metadata.get("source", "")
+    if "domain" in document.metadata:
+        source = f"{document.metadata['domain']}/{source}"
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{source}\0{document.page_content}"))
+
+
+def parse_pdf(name: str, data: bytes,
+              chunk_size: int = CHUNK_SIZE,
+              chunk_overlap: int = CHUNK_OVERLAP) -> Tuple[int, List[Document]]:
+    """Load and split one PDF, returning (page count, chunks).
+
+    Module-level so it can run in a process pool. The temporary file path is
+    replaced by the original file name in each chunk's `source` metadata, and
+    the file's content hash is stored as `file_hash`.
+    """
+    content_hash = file_hash(data)
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        tmp_file.write(data)
+        tmp_path = tmp_file.name
+    try:
+        pages = PyPDFLoader(tmp_path).load()
+    finally:
+        os.unlink(tmp_path)
+
+    for page in pages:
+        page.metadata["source"] = name
+        page.metadata["file_hash"] = content_hash
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+    return len(pages), text_splitter.split_documents(pages)
+
+
+@dataclass
+class FileStats:
+    name: str
+    pages: int = 0
+    chunks: int = 0
+    vectors: int = 0
+    unchanged: int = 0  # Chunks already stored with the same ID, not re-embedded
+
+    @property
+    def complete(self) -> bool:
+        # A file without extractable text (e.g. a scan) is complete with zero chunks
+        return self.vectors + self.unchanged == self.chunks
+
+
+@dataclass
+class IngestionStats:
+    pages: int = 0
+    chunks: int = 0
+    vectors: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    errors: List[str] = field(default_factory=list)
+    # Keyed by (file name, file hash): the same content uploaded under two names is two files
+    files: Dict[Tuple[str, str], FileStats] = field(default_factory=dict)
+    started_at: float = field(default_factory=time.perf_counter)
+    finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def rates(self) -> Tuple[float, float, float]:
+        """Pages, chunks and vectors per second so far"""
+        elapsed = max(self.elapsed, 1e-9)
+        return self.pages / elapsed, self.chunks / elapsed, self.vectors / elapsed
+
+    def summary(self) -> str:
+        pages_rate, chunks_rate, vectors_rate = self.rates()
+        summary = (f"{self.pages} pages ({pages_rate:.1f}/s) · "
+                   f"{self.chunks} chunks ({chunks_rate:.1f}/s) · "
+                   f"{self.vectors} vectors ({vectors_rate:.1f}/s)")
+        if self.unchanged or self.deleted:
+            summary += f" · {self.unchanged} unchanged · {self.deleted} removed"
+        return summary
+
+
+class IngestionPipeline:
+    """Parse, embed and upsert PDFs as overlapping stages.
+
+    PDFs are parsed on `parse_executor` (normally a process pool). Chunks flow
+    in batches through a bounded queue to `embed_concurrency` embedding
+    threads and from there through a second bounded queue to a single upsert
+    thread. Full queues block the stage before them, so memory stays bounded
+    and throughput is set by the slowest stage.
+
+    `metadata` is merged into every chunk, e.g. the domain of a shared
+    collection. Duplicate chunks within a file are collapsed by chunk_id(). When
+    `plan_fn(source, chunks) -> (chunks to embed, stale point IDs)` is given,
+    it is called once per parsed file so that chunks already stored are not
+    re-embedded; the stale IDs are passed to `delete_fn` after all upserts.
+
+    `embed_fn(texts) -> vectors`, `upsert_fn(documents, vectors)`, `plan_fn`
+    and `delete_fn(ids)` are called from worker threads and must not touch
+    Streamlit state. `progress` is called from the calling thread while the
+    pipeline runs.
+    """
+
+    def __init__(self,
+                 embed_fn: Callable[[List[str]], List[List[float]]],
+                 upsert_fn: Callable[[List[Document], List[List[float]]], None],
+                 parse_executor: Executor,
+                 metadata: Optional[dict] = None,
+                 plan_fn: Optional[Callable[[str, List[Document]], Tuple[List[Document], List[str]]]] = None,
+                 delete_fn: Optional[Callable[[List[str]], None]] = None,
+                 batch_size: int = 50,
+                 embed_concurrency: int = 4,
+                 queue_size: int = 8,
+                 progress: Optional[Callable[[IngestionStats], None]] = None,
+                 progress_interval: float = 0.5):
+        self.embed_fn = embed_fn
+        self.upsert_fn = upsert_fn
+        self.parse_executor = parse_executor
+        self.metadata = metadata or {}
+        self.plan_fn = plan_fn
+        self.delete_fn = delete_fn
+        self.batch_size = batch_size
+        self.embed_concurrency = embed_concurrency
+        self.queue_size = queue_size
+        self.progress = progress
+        self.progress_interval = progress_interval
+
+    def run(self, files: Sequence[Tuple[str, bytes]]) -> IngestionStats:
+        """Ingest (file name, PDF bytes) pairs and return the final stats"""
+        stats = IngestionStats()
+        lock = threading.Lock()
+        embed_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        upsert_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        embedders_left = [self.embed_concurrency]
+        stale_ids: List[str] = []
+        empty_files: List[str] = []
+
+        def parse_stage():
+            try:
+                futures = {self.parse_executor.submit(parse_pdf, name, data): (name, file_hash(data))
+                           for name, data in files}
+                for future in as_completed(futures):
+                    name, content_hash = futures[future]
+                    try:
+                        pages, chunks = future.result()
+                    except Exception as e:
+                        with lock:
+                            stats.errors.append(f"Error processing {name}: {e}")
+                        continue
+                    for chunk in chunks:
+                        chunk.metadata.update(self.metadata)
+                    chunks = list({chunk_id(chunk): chunk for chunk in chunks}.values())
+                    file_stats = FileStats(name, pages, len(chunks))
+                    if self.plan_fn:
+                        try:
+                            to_embed, stale = self.plan_fn(name, chunks)
+                        except Exception as e:
+                            with lock:
+                                stats.errors.append(f"Error comparing {name} with the index: {e}")
+                            continue
+                        file_stats.unchanged = len(chunks) - len(to_embed)
+                        chunks = to_embed
+                    else:
+                        stale = []
+                    with lock:
+                        stats.pages += pages
+                        stats.chunks += file_stats.chunks
+                        stats.unchanged += file_stats.unchanged
+                        stats.files[(name, content_hash)] = file_stats
+                        stale_ids.extend(stale)
+                        if not file_stats.chunks:
+                            stats.errors.append(f"No text found in {name}")
+                            empty_files.append(name)
+                    for i in range(0, len(chunks), self.batch_size):
+                        embed_queue.put(chunks[i:i + self.batch_size])
+            except Exception as e:
+                with lock:
+                    stats.errors.append(f"Error scheduling documents: {e}")
+            finally:
+                for _ in range(self.embed_concurrency):
+                    embed_queue.put(_DONE)
+
+        def embed_stage():
+            while True:
+                batch = embed_queue.get()
+                if batch is _DONE:
+                    break
+                try:
+                    vectors = self.embed_fn([doc.page_content for doc in batch])
+                    upsert_queue.put((batch, vectors))
+                except Exception as e:
+                    with lock:
+                        stats.errors.append(f"Error embedding batch of {len(batch)} chunks: {e}")
+            with lock:
+                embedders_left[0] -= 1
+                last = embedders_left[0] == 0
+            if last:
+                upsert_queue.put(_DONE)
+
+        def upsert_stage():
+            while True:
+                item = upsert_queue.get()
+                if item is _DONE:
+                    break
+                batch, vectors = item
+                try:
+                    self.upsert_fn(batch, vectors)
+                    with lock:
+                        stats.vectors += len(vectors)
+                        for doc in batch:
+                            stats.files[(doc.metadata["source"], doc.metadata["file_hash"])].vectors += 1
+                except Exception as e:
+                    with lock:
+                        stats.errors.append(f"Error adding batch of {len(batch)} chunks: {e}")
+            # Outdated chunks are only removed once every new chunk is stored
+            if stale_ids and self.delete_fn and len(stats.errors) == len(empty_files):
+                try:
+                    self.delete_fn(stale_ids)
+                    stats.deleted += len(stale_ids)
+                except Exception as e:
+                    with lock:
+                        stats.errors.append(f"Error removing {len(stale_ids)} outdated chunks: {e}")
+
+        threads = [threading.Thread(target=parse_stage, name="ingest-parse", daemon=True)]
+        threads += [threading.Thread(target=embed_stage, name=f"ingest-embed-{i}", daemon=True)
+                    for i in range(self.embed_concurrency)]
+        upserter = threading.Thread(target=upsert_stage, name="ingest-upsert", daemon=True)
+        threads.append(upserter)
+        for thread in threads:
+            thread.start()
+
+        while upserter.is_alive():
+            upserter.join(timeout=self.progress_interval)
+            if self.progress:
+                self.progress(stats)
+        stats.finished_at = time.perf_counter()
+        if self.progress:
+            self.progress(stats)
+        return stats
+
+
+class IngestionManifest:
+    """Record of which files (by name and content hash) are indexed in which collection.
+
+    Stored as a JSON file so that uploads survive reruns and restarts without
+    being parsed or embedded again. Each collection maps file names to the
+    hash and stats of the indexed version.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, dict]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._data = json.load(f)
+        # Earlier manifests were keyed by content hash, holding one name per hash
+        for collection, files in self._data.items():
+            self._data[collection] = {
+                entry["name"]: entry if "file_hash" in entry else dict(entry, file_hash=key)
+                for key, entry in files.items()
+            }
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def contains(self, collection: str, name: str, content_hash: str) -> bool:
+        entry = self._data.get(collection, {}).get(name)
+        return entry is not None and entry["file_hash"] == content_hash
+
+    def entries(self, collection: str) -> List[dict]:
+        """Indexed files of a collection, newest first"""
+        entries = [dict(entry) for entry in self._data.get(collection, {}).values()]
+        return sorted(entries, key=lambda entry: entry["ingested_at"], reverse=True)
+
+    def record(self, collection: str, content_hash: str, file_stats: FileStats):
+        """Record a file, replacing an earlier version with the same name"""
+        with self._lock:
+            self._data.setdefault(collection, {})[file_stats.name] = {
+                "name": file_stats.name,
+                "file_hash": content_hash,
+                "pages": file_stats.pages,
+                "chunks": file_stats.chunks,
+                "ingested_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            self._save()
+
+    def clear(self, collection: str):
+        with self._lock:
+            self._data.pop(collection, None)
+            self._save()
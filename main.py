@@ -2,6 +2,7 @@ import os
 
 import gc
 import tempfile
+import time
 import uuid
 import pandas as pd
 import plotly.express as px
@@ -17,6 +18,7 @@ from llama_index.core.node_parser import MarkdownNodeParser
 from llama_index.core import Document
 
 import streamlit as st
+from tracing import render_trace, span, start_metrics_server, start_trace
 
 # Torch uyarılarını gizle
 import warnings
@@ -30,6 +32,7 @@ if "id" not in st.session_state:
 
 session_id = st.session_state.id
 client = None
+start_metrics_server()
 
 @st.cache_resource
 def load_llm():
@@ -200,46 +203,50 @@ with st.sidebar:
                 st.write("Indexing your document...")
 
                 if file_key not in st.session_state.get('file_cache', {}):
-                    if os.path.exists(temp_dir):
-                        docs = load_document(file_path, file_type)
+                    with start_trace("index") as trace:
+                        if os.path.exists(temp_dir):
+                            with span("load_document", "parse", file_type=file_type):
+                                docs = load_document(file_path, file_type)
                         
-                        # Daha basit bir prompt template kullanalım
-                        qa_prompt_tmpl_str = (
-                            "Below is data from a {file_type} file.\n"
-                            "---------------------\n"
-                            "{context_str}\n"
-                            "---------------------\n"
-                            "Question: {query_str}\n"
-                            "Please provide a clear and concise answer based on the data above.\n"
-                            "If you need to calculate something, show your work.\n"
-                            "Answer: "
-                        )
-                        qa_prompt_tmpl = PromptTemplate(qa_prompt_tmpl_str)
-
-                        # Embedding modelini değiştirelim
-                        embed_model = HuggingFaceEmbedding(
-                            model_name="sentence-transformers/all-MiniLM-L6-v2",  # Daha hafif bir model
-                            trust_remote_code=True
-                        )
+                            # Daha basit bir prompt template kullanalım
+                            qa_prompt_tmpl_str = (
+                                "Below is data from a {file_type} file.\n"
+                                "---------------------\n"
+                                "{context_str}\n"
+                                "---------------------\n"
+                                "Question: {query_str}\n"
+                                "Please provide a clear and concise answer based on the data above.\n"
+                                "If you need to calculate something, show your work.\n"
+                                "Answer: "
+                            )
+                            qa_prompt_tmpl = PromptTemplate(qa_prompt_tmpl_str)
+
+                            # Embedding modelini değiştirelim
+                            embed_model = HuggingFaceEmbedding(
+                                model_name="sentence-transformers/all-MiniLM-L6-v2",  # Daha hafif bir model
+                                trust_remote_code=True
+                            )
                         
-                        Settings.embed_model = embed_model
-                        Settings.llm = load_llm()
+                            Settings.embed_model = embed_model
+                            Settings.llm = load_llm()
                         
-                        index = VectorStoreIndex.from_documents(
-                            documents=docs,
-                            show_progress=True
-                        )
+                            with span("build_index", "embedding", documents=len(docs)):
+                                index = VectorStoreIndex.from_documents(
+                                    documents=docs,
+                                    show_progress=True
+                                )
                         
-                        query_engine = index.as_query_engine(
-                            streaming=True,
-                            similarity_top_k=3  # Top 3 en alakalı sonucu al
-                        )
+                            query_engine = index.as_query_engine(
+                                streaming=True,
+                                similarity_top_k=3  # Top 3 en alakalı sonucu al
+                            )
                         
-                        query_engine.update_prompts(
-                            {"response_synthesizer:text_qa_template": qa_prompt_tmpl}
-                        )
+                            query_engine.update_prompts(
+                                {"response_synthesizer:text_qa_template": qa_prompt_tmpl}
+                            )
                         
-                        st.session_state.file_cache[file_key] = query_engine
+                            st.session_state.file_cache[file_key] = query_engine
+                    st.session_state.last_trace = trace
                 else:
                     query_engine = st.session_state.file_cache[file_key]
 
@@ -282,12 +289,19 @@ if prompt := st.chat_input("What's up?"):
         message_placeholder = st.empty()
         full_response = ""
         
-        # Simulate stream of response with milliseconds delay
-        streaming_response = query_engine.query(prompt)
-        
-        for chunk in streaming_response.response_gen:
-            full_response += chunk
-            message_placeholder.markdown(full_response + "▌")
+        with start_trace("chat") as trace:
+            # Simulate stream of response with milliseconds delay
+            with span("retrieve", "vector_search"):
+                streaming_response = query_engine.query(prompt)
+            
+            with span("generate", "llm") as generation:
+                generation_started = time.perf_counter()
+                for chunk in streaming_response.response_gen:
+                    if not full_response:
+                        generation.attrs["first_token_ms"] = round((time.perf_counter() - generation_started) * 1000)
+                    full_response += chunk
+                    message_placeholder.markdown(full_response + "▌")
+        st.session_state.last_trace = trace
 
         # full_response = query_engine.query(prompt)
 
@@ -295,4 +309,8 @@ if prompt := st.chat_input("What's up?"):
         # st.session_state.context = ctx
 
     # Add assistant response to chat history
-    st.session_state.messages.append({"role": "assistant", "content": full_response})
\ No newline at end of file
+    st.session_state.messages.append({"role": "assistant", "content": full_response})
+
+with st.sidebar:
+    if st.toggle("Debug panel", key="debug_panel"):
+        render_trace(st.session_state.get("last_trace"))
@@ -0,0 +1,208 @@
+"""Versioned schema migrations for the research history database.
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --check    # prove the history queries use their indexes
+
+Applied versions are recorded in schema_migrations; each migration runs in
+its own transaction, so a failed one can simply be retried.
+"""
+import argparse
+import datetime
+import json
+import sys
+
+from database import (HISTORY_EMBEDDING_DIMENSIONS, HISTORY_PAGE_SIZE, QUERY_CONTENT_SQL, RECENT_TOPIC_SQL,
+                      SEMANTIC_SEARCH_SQL, _history_query, _search_history_query, _vector_literal,
+                      backfill_embeddings, get_db_connection)
+
+# Key of the advisory lock that keeps two processes from migrating at once
+MIGRATION_LOCK_KEY = 7_204_511
+
+MIGRATIONS = [
+    (1, "research tables", """
+        CREATE TABLE IF NOT EXISTS research_queries (
+            id SERIAL PRIMARY KEY,
+            query_text TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS research_outputs (
+            id SERIAL PRIMARY KEY,
+            query_id INTEGER NOT NULL REFERENCES research_queries (id) ON DELETE CASCADE,
+            title TEXT,
+            content JSONB,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS research_sources (
+            id SERIAL PRIMARY KEY,
+            output_id INTEGER NOT NULL REFERENCES research_outputs (id) ON DELETE CASCADE,
+            url TEXT NOT NULL,
+            title TEXT
+        );
+    """),
+    (2, "history indexes", """
+        -- Date filters and keyset pagination on (created_at, id), in both directions
+        CREATE INDEX IF NOT EXISTS research_queries_created_at_id_idx
+            ON research_queries (created_at, id);
+        CREATE INDEX IF NOT EXISTS research_outputs_query_id_idx
+            ON research_outputs (query_id);
+        CREATE INDEX IF NOT EXISTS research_sources_output_id_idx
+            ON research_sources (output_id);
+    """),
+    (3, "trigram search", """
+        -- ILIKE '%term%' and similarity() on the searched columns
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS research_queries_query_text_trgm_idx
+            ON research_queries USING gin (query_text gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS research_outputs_title_trgm_idx
+            ON research_outputs USING gin (title gin_trgm_ops);
+    """),
+    (4, "article full-text search", """
+        -- Outputs saved without a topic get their query as title, which the search vector covers
+        UPDATE research_outputs ro
+        SET title = rq.query_text
+        FROM research_queries rq
+        WHERE rq.id = ro.query_id AND coalesce(ro.title, '') = '';
+        ALTER TABLE research_outputs ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(content->>'final_content', '')), 'B')
+            ) STORED;
+        CREATE INDEX IF NOT EXISTS research_outputs_search_vector_idx
+            ON research_outputs USING gin (search_vector);
+    """),
+    (5, "article embeddings", f"""
+        -- Filled at save time or by `python migrations.py --backfill-embeddings`
+        CREATE EXTENSION IF NOT EXISTS vector;
+        ALTER TABLE research_outputs ADD COLUMN IF NOT EXISTS embedding vector({HISTORY_EMBEDDING_DIMENSIONS});
+        CREATE INDEX IF NOT EXISTS research_outputs_embedding_idx
+            ON research_outputs USING hnsw (embedding vector_cosine_ops);
+    """),
+    (6, "generation cache", f"""
+        -- Same normalization as database.NORMALIZED_TOPIC_SQL
+        ALTER TABLE research_queries ADD COLUMN IF NOT EXISTS normalized_topic text
+            GENERATED ALWAYS AS (btrim(regexp_replace(lower(query_text), '[^[:alnum:]_]+', ' ', 'g'))) STORED;
+        CREATE INDEX IF NOT EXISTS research_queries_normalized_topic_idx
+            ON research_queries (normalized_topic, created_at);
+        -- Only compared against the queries of the freshness window, found through
+        -- the created_at index, so it needs no vector index of its own
+        ALTER TABLE research_queries ADD COLUMN IF NOT EXISTS topic_embedding vector({HISTORY_EMBEDDING_DIMENSIONS});
+    """),
+]
+
+def applied_versions(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+def migrate(target=None):
+    """Apply pending migrations up to `target` (all by default); returns the versions applied"""
+    applied = []
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+            try:
+                done = applied_versions(cur)
+                conn.commit()
+                for version, name, sql in MIGRATIONS:
+                    if version in done or (target is not None and version > target):
+                        continue
+                    try:
+                        cur.execute(sql)
+                        cur.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                            (version, name)
+                        )
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    applied.append(version)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+    return applied
+
+# The statements the history functions execute, built by the same code, each with the
+# indexes its plan must use. Every check filters or seeks, so that an index only used
+# for ORDER BY, which a non-sargable predicate would leave, does not count.
+_SINCE = datetime.date(2024, 1, 1)
+_UNTIL = datetime.date(2024, 1, 31)
+_CURSOR = (datetime.datetime(2024, 1, 15, tzinfo=datetime.timezone.utc), 1000)
+INDEX_CHECKS = [
+    ("history page, date range, newest first",
+     ["research_queries_created_at_id_idx", "research_outputs_query_id_idx"],
+     _history_query(None, _SINCE, _UNTIL, "Newest First", None, HISTORY_PAGE_SIZE)),
+    ("next history page, date range, oldest first", ["research_queries_created_at_id_idx"],
+     _history_query(None, _SINCE, _UNTIL, "Oldest First", _CURSOR, HISTORY_PAGE_SIZE)),
+    ("history text filter",
+     ["research_queries_query_text_trgm_idx", "research_outputs_title_trgm_idx"],
+     _history_query("climate", None, None, "Newest First", None, HISTORY_PAGE_SIZE)),
+    ("article full-text search", ["research_outputs_search_vector_idx"],
+     _search_history_query("climate policy", None, None, HISTORY_PAGE_SIZE, "<mark>", "</mark>")),
+    ("nearest articles", ["research_outputs_embedding_idx"],
+     (SEMANTIC_SEARCH_SQL, (_vector_literal([0.1] * HISTORY_EMBEDDING_DIMENSIONS), 5))),
+    ("same recent topic", ["research_queries_normalized_topic_idx"],
+     (RECENT_TOPIC_SQL, ("Climate policy", 24 * 3600))),
+    # How the sources are joined depends on table sizes; the lookup itself must seek
+    ("article and its sources", ["research_outputs_query_id_idx"], (QUERY_CONTENT_SQL, (1,))),
+]
+
+def _plan_indexes(plan):
+    # Only scans that search the index count; a full index scan for ORDER BY doesn't,
+    # except for a nearest-neighbour ORDER BY, which is the search
+    searched = "Index Cond" in plan or "<=>" in plan.get("Order By", "")
+    names = {plan["Index Name"]} if searched and "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= _plan_indexes(child)
+    return names
+
+def check_indexes():
+    """EXPLAIN each entry of INDEX_CHECKS with sequential scans disabled.
+
+    A sargable predicate then becomes an index condition; one that can't
+    use the index stays a filter or falls back to a sequential scan.
+    Returns (label, expected indexes, indexes used, passed) per check.
+    """
+    results = []
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off")
+            for label, indexes, (sql, params) in INDEX_CHECKS:
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                used = _plan_indexes(plan[0]["Plan"])
+                results.append((label, indexes, sorted(used), set(indexes) <= used))
+            conn.rollback()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="EXPLAIN the history queries instead of migrating")
+    parser.add_argument("--target", type=int, help="Migrate up to this version only")
+    parser.add_argument("--backfill-embeddings", action="store_true",
+                        help="Embed saved articles that have no embedding yet, in batches")
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.check:
+        failed = False
+        for label, indexes, used, passed in check_indexes():
+            print(f"{'ok  ' if passed else 'FAIL'} {label}: expected {', '.join(indexes)}, "
+                  f"plan uses {', '.join(used) or 'no index'}")
+            failed = failed or not passed
+        sys.exit(1 if failed else 0)
+
+    if args.backfill_embeddings:
+        print(f"Embedded {backfill_embeddings(args.batch_size, progress=print)} articles")
+        sys.exit(0)
+
+    applied = migrate(args.target)
+    print(f"Applied migrations: {', '.join(map(str, applied))}" if applied else "Schema is up to date")
@@ -7,12 +7,21 @@ from langchain.tools import Tool
 from langchain_openai import ChatOpenAI
 from datetime import datetime
 import json
+import html
+import time
 from database import *
 from duckduckgo_search import DDGS
+from generation_cache import GenerationCache
+from tracing import render_trace, span, start_metrics_server, start_trace, traced
 
 # Load environment variables
 load_dotenv()
 
+GENERATION_FRESHNESS_HOURS = 24  # Articles younger than this are reused for the same or a similar topic
+GENERATION_SIMILARITY_THRESHOLD = 0.9  # Topic embedding similarity for a near-duplicate
+# Match delimiters for search snippets; swapped for <mark> after the article text is escaped
+HIGHLIGHT_START, HIGHLIGHT_STOP = "\x02", "\x03"
+
 # Streamlit page config
 st.set_page_config(page_title="AI Content Generator", page_icon="📝", layout="wide")
 
@@ -142,21 +151,36 @@ h1, h2, h3 {
 </style>
 """, unsafe_allow_html=True)
 
-def search_web(query: str) -> str:
-    """Search the web for information"""
+@traced("search_web", "web_search")
+def search_web(query: str, sources=None) -> str:
+    """Search the web for information; the URL and title of each hit are appended to `sources` if given"""
     try:
         with DDGS() as ddgs:
             results = list(ddgs.text(query, max_results=5))
+        if sources is not None:
+            sources.extend({'url': r.get('href'), 'title': r.get('title', '')} for r in results)
         return "\n".join([f"- {r['body']}" for r in results])
     except Exception as e:
         return f"Search error: {str(e)}"
 
-def generate_with_cohere(topic, temperature=0.7):
-    """Generate content using Cohere directly"""
+@st.cache_resource(show_spinner=False)
+def get_cohere_client(api_key: str) -> cohere.Client:
+    """Process-wide Cohere client for the given API key, shared by every session"""
+    return cohere.Client(api_key)
+
+def generate_with_cohere(topic, temperature=0.7, placeholder=None, timing=None):
+    """Generate content using Cohere directly.
+
+    With a placeholder the article is streamed into it as it is generated,
+    and the time to first token is stored in `timing` under "first_token".
+    """
     try:
-        co = cohere.Client(os.getenv('COHERE_API_KEY'))
-        response = co.generate(
-            prompt=f"""Write a comprehensive article about {topic}.
+        co = get_cohere_client(os.getenv('COHERE_API_KEY'))
+        stream = placeholder is not None
+        with span("cohere_generate", "llm", temperature=temperature, stream=stream) as generation:
+            started = time.perf_counter()
+            response = co.generate(
+                prompt=f"""Write a comprehensive article about {topic}.
             The article should:
             - Be well-structured with clear sections
             - Include relevant information and insights
@@ -164,17 +188,36 @@ def generate_with_cohere(topic, temperature=0.7):
             - Be engaging and informative
             
             Article:""",
-            max_tokens=2000,
-            temperature=temperature,
-            model='command'  # or 'command-light', 'command-medium', 'command-xlarge'
-        )
-        return response.generations[0].text
+                max_tokens=2000,
+                temperature=temperature,
+                model='command',  # or 'command-light', 'command-medium', 'command-xlarge'
+                stream=stream
+            )
+            if not stream:
+                return response.generations[0].text
+            
+            text = ""
+            for token in response:
+                if not token.text:
+                    continue
+                if not text:
+                    first_token = time.perf_counter() - started
+                    generation.attrs["first_token_ms"] = round(first_token * 1000)
+                    if timing is not None:
+                        timing["first_token"] = first_token
+                text += token.text
+                placeholder.markdown(text + "▌")
+            # A stream that breaks off ends quietly; don't save the partial article
+            if response.finish_reason == "ERROR":
+                raise cohere.CohereError("generation stream ended with an error")
+            placeholder.markdown(text)
+            return text
     except Exception as e:
         st.error(f"Cohere error: {str(e)}")
         return None
 
-def generate_with_crew(topic):
-    """Generate content using CrewAI"""
+def generate_with_crew(topic, sources=None):
+    """Generate content using CrewAI; pages the researcher found are appended to `sources`"""
     try:
         # Disable telemetry
         os.environ["CREWAI_DISABLE_TELEMETRY"] = "true"
@@ -193,7 +236,7 @@ def generate_with_crew(topic):
             backstory='Expert researcher with vast knowledge',
             tools=[Tool(
                 name='Web Search',
-                func=search_web,
+                func=lambda query: search_web(query, sources),
                 description='Search the web for information'
             )],
             llm=llm
@@ -226,7 +269,8 @@ def generate_with_crew(topic):
             tasks=[research, write]
         )
 
-        result = crew.kickoff()
+        with span("crew_kickoff", "llm"):
+            result = crew.kickoff()
         return str(result)
         
     except Exception as e:
@@ -234,15 +278,36 @@ def generate_with_crew(topic):
         st.error("Falling back to Cohere...")
         return generate_with_cohere(topic)
 
-def save_new_content(query_text, content_text):
-    """Save new content to database"""
+@st.cache_resource(show_spinner=False)
+def get_generation_cache() -> GenerationCache:
+    """Process-wide near-duplicate topic lookup, shared by every session"""
+    return GenerationCache(
+        find_recent_by_topic,
+        find_similar_recent_topic,
+        embed_texts,
+        freshness_seconds=GENERATION_FRESHNESS_HOURS * 3600,
+        threshold=GENERATION_SIMILARITY_THRESHOLD
+    )
+
+def save_new_content(query_text, content_text, sources=None, topic_embedding=None):
+    """Save new content and its research sources to database"""
     try:
-        query_id = save_query_to_db(query_text)
         content = {
+            'topic': query_text,
             'final_content': str(content_text),
             'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
-        save_results_to_db(query_id, content)
+        try:
+            # Article and topic are embedded in one call unless the cache lookup already embedded the topic
+            if topic_embedding is None:
+                embedding, topic_embedding = embed_texts([history_embedding_text(query_text, content), query_text])
+            else:
+                embedding = embed_texts([history_embedding_text(query_text, content)])[0]
+        except Exception as e:
+            st.warning(f"The article is saved, but embedding it failed ({e}); "
+                       f"it is found by semantic search after the embeddings backfill.")
+            embedding = None
+        save_generated_content(query_text, content, sources, embedding, topic_embedding)
         return True
     except Exception as e:
         st.error(f"Save error: {str(e)}")
@@ -250,6 +315,10 @@ def save_new_content(query_text, content_text):
 
 def main():
     st.title("📝 AI Content Generator")
+    start_metrics_server()
+    
+    # Ana içerik alanı; üretim sırasında metin buraya akar, bu yüzden sidebar'dan önce oluşturulur
+    content_placeholder = st.empty()
     
     # Sidebar tasarımı
     with st.sidebar:
@@ -284,23 +353,70 @@ def main():
                 if "Cohere" in ai_model:
                     temperature = st.slider("Creativity", 0.0, 1.0, 0.7)
             
-            if st.button("Generate ✨", type="primary", use_container_width=True):
+            force_regenerate = st.checkbox(
+                "Force regenerate",
+                help=f"Don't reuse an article generated for a similar topic in the last {GENERATION_FRESHNESS_HOURS} hours"
+            )
+            
+            # Ana alandaki "Regenerate" butonu bir sonraki çalıştırmada üretimi başlatır
+            regenerate_topic = st.session_state.pop("regenerate_topic", None)
+            if st.button("Generate ✨", type="primary", use_container_width=True) or regenerate_topic:
+                topic = regenerate_topic or topic
                 if topic:
-                    with st.spinner('Creating your content...'):
+                    with st.spinner('Creating your content...'), start_trace("generate") as trace:
+                        st.session_state.last_trace = trace
                         try:
+                            generation_cache = get_generation_cache()
+                            hit, topic_embedding = None, None
+                            if force_regenerate or regenerate_topic:
+                                generation_cache.record_forced()
+                            else:
+                                hit, topic_embedding = generation_cache.lookup(topic)
+                            
+                            if hit:
+                                content = json.loads(hit.content) if isinstance(hit.content, str) else hit.content
+                                st.session_state.new_content = content.get('final_content', '')
+                                st.session_state.pop("generation_timing", None)
+                                st.session_state.generation_cache_hit = {
+                                    'topic': topic,
+                                    'query': hit.query_text,
+                                    'created_at': hit.created_at,
+                                    'similarity': hit.similarity,
+                                    'match': hit.match
+                                }
+                                st.rerun()
+                            
+                            sources = []
+                            timing = {}
+                            started = time.perf_counter()
                             if "Cohere" in ai_model:
-                                result = generate_with_cohere(topic, temperature)
+                                result = generate_with_cohere(topic, temperature, content_placeholder, timing)
                             else:
-                                result = generate_with_crew(topic)
+                                result = generate_with_crew(topic, sources)
+                            if result:
+                                elapsed = time.perf_counter() - started
+                                generation_cache.record_generation(elapsed)
                                 
-                            if result and save_new_content(topic, result):
+                            # The streamed text is saved only once the stream has completed
+                            if result and save_new_content(topic, result, sources, topic_embedding):
                                 st.success("Content generated!")
                                 st.session_state.new_content = result
+                                st.session_state.generation_timing = {
+                                    'first_token': timing.get('first_token'),
+                                    'total': elapsed
+                                }
+                                st.session_state.pop("generation_cache_hit", None)
+                                st.session_state.pop("history_filters", None)  # Reload history with the new entry
                                 st.rerun()
                         except Exception as e:
                             st.error(f"Error: {str(e)}")
                 else:
                     st.warning("Please enter a topic")
+            
+            cache_stats = get_generation_cache().stats()
+            if cache_stats["lookups"]:
+                st.caption(f"Reused {cache_stats['hits']} of {cache_stats['lookups']} topics "
+                           f"({cache_stats['hit_rate']:.0%}) · ~{cache_stats['time_saved_seconds']:.0f}s saved")
 
         st.markdown("---")
         
@@ -314,32 +430,50 @@ def main():
         sort_order = st.selectbox(
             "Sort by",
             ["Newest First", "Oldest First"],
-            label_visibility="collapsed"
+            label_visibility="collapsed",
+            disabled=bool(search)
         )
+        if search:
+            st.caption("Search results are ranked by relevance")
 
-    # Ana içerik alanı
-    content_placeholder = st.empty()
-    
     with content_placeholder.container():
         if 'new_content' in st.session_state:
-            # Daktilo efekti için JavaScript
-            st.markdown("""
-            <style>
-            @keyframes typing {
-                from { width: 0 }
-                to { width: 100% }
-            }
-            .typing-effect {
-                overflow: hidden;
-                white-space: pre-wrap;
-                animation: typing 2s steps(40, end);
-            }
-            </style>
-            """, unsafe_allow_html=True)
+            generation_timing = st.session_state.get('generation_timing') or {}
+            # Daktilo efekti için JavaScript; akışla gelen metin zaten yazılırken gösterildi
+            if not generation_timing.get('first_token'):
+                st.markdown("""
+                <style>
+                @keyframes typing {
+                    from { width: 0 }
+                    to { width: 100% }
+                }
+                .typing-effect {
+                    overflow: hidden;
+                    white-space: pre-wrap;
+                    animation: typing 2s steps(40, end);
+                }
+                </style>
+                """, unsafe_allow_html=True)
+
+            cache_hit = st.session_state.get('generation_cache_hit')
+            if cache_hit:
+                age = datetime.now(cache_hit['created_at'].tzinfo) - cache_hit['created_at']
+                st.info(f"Reused the article generated {age.seconds // 3600} h {age.seconds % 3600 // 60} min ago "
+                        f"for \"{cache_hit['query']}\" ({cache_hit['match']} match, "
+                        f"similarity {cache_hit['similarity']:.2f}).")
+                if st.button("Regenerate", key="regenerate"):
+                    st.session_state.regenerate_topic = cache_hit['topic']
+                    st.rerun()
             
             st.markdown(f'<div class="typing-effect">{st.session_state.new_content}</div>', 
                        unsafe_allow_html=True)
-            
+
+            if generation_timing.get('first_token'):
+                st.caption(f"First token after {generation_timing['first_token']:.2f}s · "
+                           f"complete after {generation_timing['total']:.2f}s")
+            elif generation_timing:
+                st.caption(f"Generated in {generation_timing['total']:.2f}s")
+
         elif 'selected_query' in st.session_state:
             query = st.session_state.selected_query
             st.header(query['query'])
@@ -353,18 +487,48 @@ def main():
             else:
                 st.markdown(f'<div class="typing-effect">{str(content)}</div>', 
                           unsafe_allow_html=True)
+            
+            if query.get('sources'):
+                st.markdown("**Sources**")
+                for source in query['sources']:
+                    st.markdown(f"- [{source['title'] or source['url']}]({source['url']})")
         else:
             st.info("👈 Generate new content or select from history")
 
-    # History listesi
-    history = get_filtered_history(search, start_date, end_date, sort_order)
+    # History listesi: sayfalar session'da tutulur, filtre değişince sıfırlanır
+    filters = (search, start_date, end_date, sort_order)
+    if st.session_state.get("history_filters") != filters:
+        st.session_state.history_filters = filters
+        st.session_state.history_rows = []
+        st.session_state.history_cursor = None
+        st.session_state.history_done = False
+    
+    if not st.session_state.history_rows and not st.session_state.history_done:
+        with start_trace("history") as history_trace:
+            if search:
+                # Arama: içerikte tam metin arama, en iyi eşleşmeler tek sayfada
+                rows, cursor = search_history(search, start_date, end_date,
+                                              start_sel=HIGHLIGHT_START, stop_sel=HIGHLIGHT_STOP), None
+            else:
+                rows, cursor = get_filtered_history(search, start_date, end_date, sort_order)
+        st.session_state.history_rows = rows
+        st.session_state.history_cursor = cursor
+        st.session_state.history_done = cursor is None
+        st.session_state.history_trace = history_trace
     
-    for query_id, query, created_at, content, title in history:
+    for query_id, query, title, created_at, snippet in st.session_state.history_rows:
         with st.sidebar:
             col1, col2 = st.columns([8, 2])
             
             with col1:
-                # Sol tarafta başlık ve tarih
+                # Sol tarafta başlık ve tarih; aramada eşleşen metin parçası da gösterilir
+                preview = "" if search else html.escape(snippet or '')
+                headline = ""
+                if search and snippet:
+                    highlighted = (html.escape(snippet)
+                                   .replace(HIGHLIGHT_START, "<mark>")
+                                   .replace(HIGHLIGHT_STOP, "</mark>"))
+                    headline = f"<div style='font-size: 0.75em; color: #A0A0A0; margin-top: 4px;'>{highlighted}</div>"
                 st.markdown(f"""
                     <div style='
                         padding: 0.5rem;
@@ -374,11 +538,12 @@ def main():
                             font-size: 0.9em; 
                             color: #E0E0E0;
                             margin-bottom: 4px;
-                        '>{query[:50]}...</div>
+                        ' title="{preview}">{query[:50]}...</div>
                         <div style='
                             font-size: 0.7em; 
                             color: #808080;
                         '>{created_at.strftime('%Y-%m-%d %H:%M')}</div>
+                        {headline}
                     </div>
                 """, unsafe_allow_html=True)
             
@@ -386,13 +551,17 @@ def main():
                 # Sağ tarafta view butonu
                 if st.button("View", key=f"view_{query_id}"):
                     try:
-                        if content:
+                        row = get_query_content(query_id)
+                        if row and row[0]:
+                            content, title, sources = row
                             content_data = json.loads(content) if isinstance(content, str) else content
+                            st.session_state.pop('new_content', None)
                             st.session_state.selected_query = {
                                 'id': query_id,
                                 'query': query,
                                 'created_at': created_at,
-                                'content': content_data
+                                'content': content_data,
+                                'sources': sources
                             }
                             st.rerun()
                     except Exception as e:
@@ -401,5 +570,24 @@ def main():
             # Ayırıcı çizgi
             st.markdown("<hr style='margin: 5px 0; opacity: 0.2;'>", unsafe_allow_html=True)
 
+    with st.sidebar:
+        if not st.session_state.history_done and st.button("Load more", use_container_width=True):
+            with start_trace("history") as history_trace:
+                rows, cursor = get_filtered_history(search, start_date, end_date, sort_order,
+                                                    cursor=st.session_state.history_cursor)
+            st.session_state.history_rows += rows
+            st.session_state.history_cursor = cursor
+            st.session_state.history_done = cursor is None
+            st.session_state.history_trace = history_trace
+            st.rerun()
+        
+        if st.toggle("Debug panel", key="debug_panel"):
+            render_trace(st.session_state.get("last_trace"), "Debug: last generation")
+            render_trace(st.session_state.get("history_trace"), "Debug: history query")
+            st.caption("Database pool")
+            st.json(get_pool_stats())
+            st.caption("Generation cache")
+            st.json(get_generation_cache().stats())
+
 if __name__ == "__main__":
     main()
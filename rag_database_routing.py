@@ -1,24 +1,29 @@
+import hashlib
+import multiprocessing
 import os
-from typing import List, Dict, Any, Literal, Optional
-from dataclasses import dataclass
+import time
+from typing import List, Dict, Any, Iterable, Literal, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
 import streamlit as st
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import Qdrant
+from langchain_core.vectorstores import VectorStore
 from langchain_openai import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
-import tempfile
-from langchain.schema import HumanMessage
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains import create_retrieval_chain
 from langchain import hub
-from langgraph.prebuilt import create_react_agent
 from langchain_community.tools import DuckDuckGoSearchRun
-from langchain_core.language_models import BaseLanguageModel
 from langchain.prompts import ChatPromptTemplate
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
+from qdrant_client.models import Distance, PayloadSchemaType
+from storage_profiles import STORAGE_PROFILES, StorageProfile
+from centroid_router import CentroidRouter
+from semantic_cache import SemanticCache
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from vector_stores import DomainView, LocalVectorStore, QdrantStore
+from web_fallback import SearchCache, WebFallback
+from tracing import current_trace, in_current_context, render_trace, span, start_metrics_server, start_trace
+from ingestion import IngestionManifest, IngestionPipeline, IngestionStats, chunk_id, file_hash
 
 def init_session_state():
     """Initialize session state variables"""
@@ -28,6 +33,16 @@ def init_session_state():
         st.session_state.qdrant_url = ""
     if 'qdrant_api_key' not in st.session_state:
         st.session_state.qdrant_api_key = ""
+    if 'vector_backend' not in st.session_state:
+        st.session_state.vector_backend = "qdrant"
+    if 'collection_layout' not in st.session_state:
+        st.session_state.collection_layout = "separate"
+    if 'stream_answers' not in st.session_state:
+        st.session_state.stream_answers = True
+    if 'debug_panel' not in st.session_state:
+        st.session_state.debug_panel = False
+    if 'last_trace' not in st.session_state:
+        st.session_state.last_trace = None
     if 'embeddings' not in st.session_state:
         st.session_state.embeddings = None
     if 'llm' not in st.session_state:
@@ -39,12 +54,14 @@ init_session_state()
 
 DatabaseType = Literal["products", "support", "finance"]
 PERSIST_DIRECTORY = "db_storage"
+LOCAL_STORE_DIRECTORY = os.path.join(PERSIST_DIRECTORY, "local")
 
 @dataclass
 class CollectionConfig:
     name: str
     description: str
-    collection_name: str  # This will be used as Qdrant collection name
+    collection_name: str  # Qdrant collection name, or directory name for the local store
+    profile: StorageProfile = STORAGE_PROFILES["exact"]  # Dimensions, quantization and HNSW settings
 
 # Collection configurations
 COLLECTIONS: Dict[DatabaseType, CollectionConfig] = {
@@ -65,83 +82,386 @@ COLLECTIONS: Dict[DatabaseType, CollectionConfig] = {
     )
 }
 
+# Optional single-collection layout: every domain lives in one collection and
+# is told apart by an indexed `domain` metadata field
+SHARED_COLLECTION = CollectionConfig(
+    name="All Domains",
+    description="Documents of every domain, filtered by their domain field",
+    collection_name="documents_collection"
+)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Full-size query embeddings are shortened per collection (see storage_profiles)
+ROUTER_DIMENSIONS = min(config.profile.dimensions for config in [*COLLECTIONS.values(), SHARED_COLLECTION])
+VECTOR_DISTANCE = Distance.COSINE
+ROUTING_K = 3  # Hits averaged per collection for the routing score
+RETRIEVAL_K = 4  # Hits passed to the answer chain
+CONFIDENCE_THRESHOLD = 0.5  # Minimum similarity for vector-based routing
+ROUTER_MIN_MARGIN = 0.05  # Centroid lead over the runner-up needed to skip the searches
+CACHE_SIMILARITY_THRESHOLD = 0.95  # Default query similarity for a semantic cache hit
+CACHE_MAX_ENTRIES = 512
+CACHE_TTL_SECONDS = 3600
+EMBEDDING_CACHE_PATH = os.path.join(PERSIST_DIRECTORY, "embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_AGE = 30 * 24 * 3600  # Drop chunk embeddings unused for 30 days
+EMBEDDING_CACHE_MAX_ENTRIES = 500_000
+WEB_FALLBACK_BUDGET_SECONDS = 20.0  # Hard wall-clock limit for one web fallback answer
+WEB_SEARCH_TIMEOUT_SECONDS = 8.0
+WEB_SEARCH_TTL_SECONDS = 6 * 3600
+
+@st.cache_resource(show_spinner=False)
+def get_qdrant_client(url: str, api_key: str) -> QdrantClient:
+    """Process-wide Qdrant client, shared by every session and rerun"""
+    client = QdrantClient(
+        url=url,
+        api_key=api_key,
+        timeout=60  # Timeout süresini 60 saniyeye çıkar
+    )
+    # Test connection
+    client.get_collections()
+    return client
+
+@st.cache_resource(show_spinner=False)
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide on-disk chunk embedding cache, pruned once at startup"""
+    cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    cache.prune(max_age_seconds=EMBEDDING_CACHE_MAX_AGE, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+    return cache
+
+@st.cache_resource(show_spinner=False)
+def get_models(openai_api_key: str):
+    """Process-wide embeddings and chat model for the given API key"""
+    os.environ["OPENAI_API_KEY"] = openai_api_key
+    embeddings = CachedEmbeddings(
+        OpenAIEmbeddings(model=EMBEDDING_MODEL),
+        cache=get_embedding_cache(),
+        model=EMBEDDING_MODEL
+    )
+    llm = ChatOpenAI(temperature=0)
+    return embeddings, llm
+
+def _ensure_payload_indexes(client: QdrantClient, collection_name: str, fields: List[str], existing=()):
+    for field_name in fields:
+        if field_name not in existing:
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=PayloadSchemaType.KEYWORD
+            )
+
+def ensure_collection(client: QdrantClient, config: CollectionConfig,
+                      payload_indexes: Optional[List[str]] = None) -> bool:
+    """Create the collection if it is missing and validate it otherwise.
+
+    Returns True when the collection was created. Raises ValueError when an
+    existing collection has an incompatible vector size or distance; use
+    reset_collection() to rebuild it explicitly. HNSW and quantization
+    settings that differ from the storage profile are updated in place, and
+    missing keyword indexes on `payload_indexes` are created.
+    """
+    profile = config.profile
+    payload_indexes = payload_indexes or ["metadata.source"]
+    existing = {c.name for c in client.get_collections().collections}
+    if config.collection_name not in existing:
+        client.create_collection(
+            collection_name=config.collection_name,
+            vectors_config=profile.vector_params(VECTOR_DISTANCE),
+            hnsw_config=profile.hnsw_config(),
+            quantization_config=profile.quantization_config()
+        )
+        _ensure_payload_indexes(client, config.collection_name, payload_indexes)
+        return True
+
+    collection_info = client.get_collection(config.collection_name)
+    _ensure_payload_indexes(client, config.collection_name, payload_indexes,
+                            existing=(collection_info.payload_schema or {}).keys())
+    collection_config = collection_info.config
+    vectors = collection_config.params.vectors
+    if isinstance(vectors, dict):
+        raise ValueError(
+            f"Collection {config.collection_name} uses named vectors, expected a single unnamed vector"
+        )
+    if vectors.size != profile.dimensions or vectors.distance != VECTOR_DISTANCE:
+        raise ValueError(
+            f"Collection {config.collection_name} has vectors of size {vectors.size} "
+            f"({vectors.distance}), expected {profile.dimensions} ({VECTOR_DISTANCE}). "
+            "Reset the collection to rebuild it."
+        )
+    if profile.needs_update(collection_config):
+        client.update_collection(collection_name=config.collection_name, **profile.update_kwargs())
+    return False
+
+def _qdrant_store(client: QdrantClient, config: CollectionConfig, embeddings) -> QdrantStore:
+    return QdrantStore(
+        client=client,
+        collection_name=config.collection_name,
+        embeddings=embeddings,
+        dimensions=config.profile.dimensions,
+        search_params=config.profile.search_params()
+    )
+
+@st.cache_resource(show_spinner=False)
+def load_databases(openai_api_key: str, qdrant_url: str, qdrant_api_key: str,
+                   layout: str = "separate") -> Dict[DatabaseType, Any]:
+    """Bootstrap all collections once per process and wrap them for LangChain.
+
+    Existing collections and their documents are kept as they are, so reruns
+    and restarts do not require re-ingesting anything. In the shared layout
+    every domain is a DomainView over SHARED_COLLECTION.
+    """
+    client = get_qdrant_client(qdrant_url, qdrant_api_key)
+    embeddings, _ = get_models(openai_api_key)
+
+    if layout == "shared":
+        ensure_collection(client, SHARED_COLLECTION, payload_indexes=["metadata.domain", "metadata.source"])
+        shared = _qdrant_store(client, SHARED_COLLECTION, embeddings)
+        return {db_type: DomainView(shared, db_type) for db_type in COLLECTIONS}
+
+    databases = {}
+    for db_type, config in COLLECTIONS.items():
+        ensure_collection(client, config)
+        databases[db_type] = _qdrant_store(client, config, embeddings)
+    return databases
+
+@st.cache_resource(show_spinner=False)
+def load_local_databases(openai_api_key: str, layout: str = "separate") -> Dict[DatabaseType, Any]:
+    """Open the in-process stores under PERSIST_DIRECTORY once per process"""
+    embeddings, _ = get_models(openai_api_key)
+
+    def open_store(config: CollectionConfig) -> LocalVectorStore:
+        return LocalVectorStore(
+            os.path.join(LOCAL_STORE_DIRECTORY, config.collection_name),
+            embeddings,
+            config.profile.dimensions
+        )
+
+    if layout == "shared":
+        shared = open_store(SHARED_COLLECTION)
+        return {db_type: DomainView(shared, db_type) for db_type in COLLECTIONS}
+    return {db_type: open_store(config) for db_type, config in COLLECTIONS.items()}
+
+def get_store_key() -> str:
+    """Identifies the active vector store for per-store caches and state files"""
+    backend = "local" if st.session_state.vector_backend == "local" else st.session_state.qdrant_url
+    if st.session_state.collection_layout == "shared":
+        return f"{backend}#shared"
+    return backend
+
+def _store_state_path(store_key: str, prefix: str, extension: str) -> str:
+    key_hash = hashlib.sha1(store_key.encode()).hexdigest()[:12]
+    return os.path.join(PERSIST_DIRECTORY, f"{prefix}_{key_hash}.{extension}")
+
+@st.cache_resource(show_spinner=False)
+def get_centroid_router(store_key: str, _databases) -> CentroidRouter:
+    """Process-wide centroid router, restored from disk and checked against the store.
+
+    Collections whose point count no longer matches the saved state are
+    rebuilt by reading their stored vectors once.
+    """
+    router = CentroidRouter(COLLECTIONS.keys(), ROUTER_DIMENSIONS)
+    path = _store_state_path(store_key, "centroids", "npz")
+    router.load(path)
+
+    stale = False
+    for db_type, db in _databases.items():
+        if db.count() == router.counts()[db_type]:
+            continue
+        stale = True
+        router.reset(db_type)
+        for vectors in db.iter_vectors():
+            router.add(db_type, vectors)
+    if stale:
+        router.save(path)
+    return router
+
+def _active_router() -> CentroidRouter:
+    return get_centroid_router(get_store_key(), st.session_state.databases)
+
+@st.cache_resource(show_spinner=False)
+def get_web_fallback(openai_api_key: str) -> WebFallback:
+    """Web research agent and its search cache, built once per process"""
+    # A streaming model of its own, so the agent's answer tokens reach the page as they arrive.
+    # A call and its one retry fit in the budget, so an abandoned run frees its worker soon after.
+    llm = ChatOpenAI(temperature=0, streaming=True, openai_api_key=openai_api_key,
+                     request_timeout=WEB_FALLBACK_BUDGET_SECONDS / 2, max_retries=1)
+    search = DuckDuckGoSearchRun(num_results=5)
+    return WebFallback(
+        llm,
+        search.run,
+        cache=SearchCache(ttl_seconds=WEB_SEARCH_TTL_SECONDS),
+        budget_seconds=WEB_FALLBACK_BUDGET_SECONDS,
+        search_timeout=WEB_SEARCH_TIMEOUT_SECONDS
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache(store_key: str) -> SemanticCache:
+    """Process-wide semantic answer cache for the given vector store"""
+    return SemanticCache(
+        threshold=CACHE_SIMILARITY_THRESHOLD,
+        max_entries=CACHE_MAX_ENTRIES,
+        ttl_seconds=CACHE_TTL_SECONDS
+    )
+
+def _document_sink(db_type: DatabaseType):
+    """Return an upsert function for embedded documents of db_type.
+
+    Everything it needs is captured up front, so the function can run on
+    ingestion worker threads without access to Streamlit session state.
+    """
+    db = st.session_state.databases[db_type]
+    router = _active_router()
+    router_path = _store_state_path(get_store_key(), "centroids", "npz")
+    cache = get_semantic_cache(get_store_key())
+    trace = current_trace()
+
+    def upsert(documents: List[Document], vectors: List[List[float]]):
+        with span("upsert", "vector_store", trace=trace, chunks=len(documents)):
+            db.upsert_embeddings([chunk_id(doc) for doc in documents], vectors, documents)
+        router.add(db_type, vectors)
+        router.save(router_path)
+        cache.invalidate(db_type)
+
+    return upsert
+
+def _document_planner(db_type: DatabaseType):
+    """Return a plan function that diffs parsed chunks against the stored ones.
+
+    Chunks whose deterministic ID is already stored are skipped; stored IDs
+    that no longer occur in the document are returned as stale.
+    """
+    db = st.session_state.databases[db_type]
+
+    def plan(source: str, chunks: List[Document]) -> Tuple[List[Document], List[str]]:
+        existing = set(db.ids_where({"source": source}))
+        current = {chunk_id(chunk): chunk for chunk in chunks}
+        to_embed = [chunk for point_id, chunk in current.items() if point_id not in existing]
+        stale = [point_id for point_id in existing if point_id not in current]
+        return to_embed, stale
+
+    return plan
+
+def _document_remover(db_type: DatabaseType):
+    """Return a delete function that also takes the points out of the centroids"""
+    db = st.session_state.databases[db_type]
+    router = _active_router()
+    router_path = _store_state_path(get_store_key(), "centroids", "npz")
+    cache = get_semantic_cache(get_store_key())
+
+    def delete(ids: List[str]):
+        vectors = db.get_vectors(ids)
+        db.delete(ids)
+        router.remove(db_type, vectors)
+        router.save(router_path)
+        cache.invalidate(db_type)
+
+    return delete
+
+@st.cache_resource(show_spinner=False)
+def get_parse_executor() -> ProcessPoolExecutor:
+    """Process-wide pool for PDF parsing and splitting"""
+    return ProcessPoolExecutor(
+        max_workers=max(1, min(4, (os.cpu_count() or 2) - 1)),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_ingestion_manifest(store_key: str) -> IngestionManifest:
+    """Process-wide manifest of files already indexed in the given vector store"""
+    return IngestionManifest(_store_state_path(store_key, "manifest", "json"))
+
+def ingest_files(db_type: DatabaseType, files, progress=None) -> IngestionStats:
+    """Run uploaded files that are not indexed yet through the staged pipeline.
+
+    Revised versions of already indexed files are re-indexed incrementally:
+    only new chunks are embedded and removed chunks are deleted.
+    """
+    collection_name = COLLECTIONS[db_type].collection_name
+    manifest = get_ingestion_manifest(get_store_key())
+    pending = {}
+    for file in files:
+        data = file.getvalue()
+        content_hash = file_hash(data)
+        if not manifest.contains(collection_name, file.name, content_hash):
+            pending[(file.name, content_hash)] = (file.name, data)
+    if not pending:
+        return IngestionStats()
+
+    embeddings = st.session_state.embeddings
+    trace = current_trace()
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        with span("embed_documents", "embedding", trace=trace, chunks=len(texts)):
+            return embeddings.embed_documents(texts)
+
+    pipeline = IngestionPipeline(
+        embed_fn=embed,
+        upsert_fn=_document_sink(db_type),
+        parse_executor=get_parse_executor(),
+        metadata={"domain": db_type} if st.session_state.collection_layout == "shared" else None,
+        plan_fn=_document_planner(db_type),
+        delete_fn=_document_remover(db_type),
+        progress=progress
+    )
+    stats = pipeline.run(list(pending.values()))
+    for (_, content_hash), file_stats in stats.files.items():
+        if file_stats.complete:
+            manifest.record(collection_name, content_hash, file_stats)
+    return stats
+
+def reset_collection(db_type: DatabaseType):
+    """Drop and recreate a single collection, removing all of its documents"""
+    config = COLLECTIONS[db_type]
+    if st.session_state.vector_backend == "local" or st.session_state.collection_layout == "shared":
+        st.session_state.databases[db_type].reset()
+    else:
+        client = get_qdrant_client(st.session_state.qdrant_url, st.session_state.qdrant_api_key)
+        try:
+            client.delete_collection(config.collection_name)
+        except Exception:
+            pass  # Koleksiyon yoksa hata vermesini engelle
+        ensure_collection(client, config)
+
+    store_key = get_store_key()
+    router = _active_router()
+    router.reset(db_type)
+    router.save(_store_state_path(store_key, "centroids", "npz"))
+    get_semantic_cache(store_key).invalidate(db_type)
+    get_ingestion_manifest(store_key).clear(config.collection_name)
+
+def has_credentials() -> bool:
+    """Whether everything needed by the selected vector store backend was entered"""
+    if not st.session_state.openai_api_key:
+        return False
+    if st.session_state.vector_backend == "local":
+        return True
+    return bool(st.session_state.qdrant_url and st.session_state.qdrant_api_key)
+
 def initialize_models():
-    """Initialize OpenAI models and Qdrant client"""
-    if (st.session_state.openai_api_key and 
-        st.session_state.qdrant_url and 
-        st.session_state.qdrant_api_key):
+    """Initialize OpenAI models and the selected vector store"""
+    if has_credentials():
         
         os.environ["OPENAI_API_KEY"] = st.session_state.openai_api_key
-        st.session_state.embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-        st.session_state.llm = ChatOpenAI(temperature=0)
+        st.session_state.embeddings, st.session_state.llm = get_models(st.session_state.openai_api_key)
         
         try:
-            # Initialize Qdrant client with session state credentials and timeout settings
-            client = QdrantClient(
-                url=st.session_state.qdrant_url,
-                api_key=st.session_state.qdrant_api_key,
-                timeout=60  # Timeout süresini 60 saniyeye çıkar
-            )
-            
-            # Test connection
-            client.get_collections()
-            vector_size = 1536  
-            st.session_state.databases = {}
-            
-            for db_type, config in COLLECTIONS.items():
-                try:
-                    # Koleksiyonu silip yeniden oluştur
-                    try:
-                        client.delete_collection(config.collection_name)
-                    except Exception:
-                        pass  # Koleksiyon yoksa hata vermesini engelle
-                        
-                    # Yeni koleksiyon oluştur
-                    client.create_collection(
-                        collection_name=config.collection_name,
-                        vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE)
-                    )
-                    
-                    st.session_state.databases[db_type] = Qdrant(
-                        client=client,
-                        collection_name=config.collection_name,
-                        embeddings=st.session_state.embeddings
-                    )
-                except Exception as e:
-                    st.error(f"Failed to initialize collection {config.collection_name}: {str(e)}")
-                    return False
-            
+            if st.session_state.vector_backend == "local":
+                st.session_state.databases = load_local_databases(
+                    st.session_state.openai_api_key,
+                    st.session_state.collection_layout
+                )
+            else:
+                st.session_state.databases = load_databases(
+                    st.session_state.openai_api_key,
+                    st.session_state.qdrant_url,
+                    st.session_state.qdrant_api_key,
+                    st.session_state.collection_layout
+                )
             return True
             
         except Exception as e:
-            st.error(f"Failed to connect to Qdrant: {str(e)}")
+            st.error(f"Failed to initialize vector store collections: {str(e)}")
             return False
     return False
 
-def process_document(file) -> List[Document]:
-    """Process uploaded PDF document"""
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(file.getvalue())
-            tmp_path = tmp_file.name
-            
-        loader = PyPDFLoader(tmp_path)
-        documents = loader.load()
-        
-        # Clean up temporary file
-        os.unlink(tmp_path)
-        
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,  # Chunk boyutunu küçült
-            chunk_overlap=50  # Overlap'i azalt
-        )
-        texts = text_splitter.split_documents(documents)
-        
-        return texts
-    except Exception as e:
-        st.error(f"Error processing document: {e}")
-        return []
-
 def create_routing_agent():
     """Creates a routing agent using LangChain"""
     prompt = ChatPromptTemplate.from_messages([
@@ -160,21 +480,76 @@ def create_routing_agent():
     chain = prompt | st.session_state.llm
     return chain
 
-def route_query(question: str) -> Optional[DatabaseType]:
+@st.cache_resource(show_spinner=False)
+def get_search_executor() -> ThreadPoolExecutor:
+    """Process-wide thread pool used to fan out vector searches"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="vector-search")
+
+def search_collections(query_vector: List[float], k: int = 3) -> Dict[DatabaseType, List[Tuple[Document, float]]]:
+    """Run the same vector search against every collection concurrently.
+
+    In the shared layout this is a single grouped search returning the top k
+    hits of every domain.
+    """
+    if st.session_state.collection_layout == "shared":
+        shared = next(iter(st.session_state.databases.values())).store
+        with span("grouped_search", "vector_search", k=k):
+            groups = shared.grouped_search(query_vector, group_by="domain", group_size=k, limit=len(COLLECTIONS))
+        return {db_type: groups.get(db_type, []) for db_type in COLLECTIONS}
+
+    def search(db_type: DatabaseType, db) -> List[Tuple[Document, float]]:
+        with span(f"search:{db_type}", "vector_search", k=k):
+            return db.similarity_search_with_score_by_vector(query_vector, k=k)
+
+    executor = get_search_executor()
+    with span("search_collections", "vector_search", collections=len(st.session_state.databases)):
+        futures = {
+            db_type: executor.submit(in_current_context(search), db_type, db)
+            for db_type, db in st.session_state.databases.items()
+        }
+        return {db_type: future.result() for db_type, future in futures.items()}
+
+@dataclass
+class RoutingResult:
+    """Routing decision plus the query vector and per-collection hits it was based on"""
+    db_type: Optional[DatabaseType]
+    query_vector: Optional[List[float]] = None
+    hits: Dict[DatabaseType, List[Tuple[Document, float]]] = field(default_factory=dict)
+
+    def documents(self, db_type: DatabaseType) -> List[Document]:
+        """Documents already retrieved for db_type during routing"""
+        return [doc for doc, _ in self.hits.get(db_type, [])]
+
+def route_query(question: str, query_vector: Optional[List[float]] = None) -> RoutingResult:
     """Route query by searching all databases and comparing relevance scores.
-    Returns None if no suitable database is found."""
+    The returned db_type is None if no suitable database is found."""
+    result = RoutingResult(db_type=None, query_vector=query_vector)
     try:
         best_score = -1
         best_db_type = None
         all_scores = {}  # Store all scores for debugging
         
-        # Search each database and compare relevance scores
-        for db_type, db in st.session_state.databases.items():
-            results = db.similarity_search_with_score(
-                question,
-                k=3
-            )
-            
+        if result.query_vector is None:
+            with span("embed_query", "embedding"):
+                result.query_vector = st.session_state.embeddings.embed_query(question)
+
+        # Centroid routing needs no vector search; only thin margins fall through
+        router = _active_router()
+        with span("centroid_route", "routing") as centroid:
+            centroid_db_type, centroid_score, margin = router.route(result.query_vector)
+            centroid.attrs.update(label=centroid_db_type, score=round(centroid_score, 3), margin=round(margin, 3))
+        if (centroid_db_type and centroid_score >= CONFIDENCE_THRESHOLD
+                and margin >= ROUTER_MIN_MARGIN):
+            st.success(f"Using centroid routing: {centroid_db_type} "
+                       f"(confidence: {centroid_score:.3f}, margin: {margin:.3f})")
+            result.db_type = centroid_db_type
+            return result
+
+        # Search each database in parallel. The hits are kept so that
+        # query_database can answer without searching again.
+        result.hits = search_collections(result.query_vector, k=RETRIEVAL_K)
+        for db_type, results in result.hits.items():
+            results = results[:ROUTING_K]
             if results:
                 avg_score = sum(score for _, score in results) / len(results)
                 all_scores[db_type] = avg_score
@@ -183,59 +558,74 @@ def route_query(question: str) -> Optional[DatabaseType]:
                     best_score = avg_score
                     best_db_type = db_type
         
-        confidence_threshold = 0.5
-        if best_score >= confidence_threshold and best_db_type:
+        if best_score >= CONFIDENCE_THRESHOLD and best_db_type:
             st.success(f"Using vector similarity routing: {best_db_type} (confidence: {best_score:.3f})")
-            return best_db_type
+            result.db_type = best_db_type
+            return result
             
-        st.warning(f"Low confidence scores (below {confidence_threshold}), falling back to LLM routing")
+        st.warning(f"Low confidence scores (below {CONFIDENCE_THRESHOLD}), falling back to LLM routing")
         
         # Fallback to LLM routing
         routing_agent = create_routing_agent()
-        response = routing_agent.invoke({"question": question})
+        with span("llm_router", "llm"):
+            response = routing_agent.invoke({"question": question})
         
         db_type = response.content.strip().lower()
         
         if db_type in COLLECTIONS:
             st.success(f"Using LLM routing decision: {db_type}")
-            return db_type
+            result.db_type = db_type
+            return result
             
         st.warning("No suitable database found, will use web search fallback")
-        return None
+        return result
         
     except Exception as e:
         st.error(f"Routing error: {str(e)}")
-        return None
+        result.db_type = None
+        return result
 
-def create_fallback_agent(chat_model: BaseLanguageModel):
-    """Create a LangGraph agent for web research."""
-    
-    def web_research(query: str) -> str:
-        """Web search with result formatting."""
-        try:
-            search = DuckDuckGoSearchRun(num_results=5)
-            results = search.run(query)
-            return results
-        except Exception as e:
-            return f"Search failed: {str(e)}. Providing answer based on general knowledge."
+def render_stream(chunks: Iterable[str], placeholder, started_at: Optional[float] = None) -> str:
+    """Render text chunks into placeholder as they arrive and return the full text.
 
-    tools = [web_research]
-    
-    agent = create_react_agent(model=chat_model,
-                             tools=tools,
-                             debug=False)
-    
-    return agent
+    Time to first token is measured from started_at (default: now) and shown
+    below the answer together with the total time.
+    """
+    started_at = started_at or time.perf_counter()
+    first_token_at = None
+    text = ""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        text += chunk
+        placeholder.markdown(text + "▌")
+    placeholder.markdown(text)
+    finished_at = time.perf_counter()
+    if first_token_at is not None:
+        st.caption(f"First token after {first_token_at - started_at:.2f}s · "
+                   f"complete after {finished_at - started_at:.2f}s")
+    return text
 
-def query_database(db: Qdrant, question: str) -> tuple[str, list]:
-    """Query the database and return answer and relevant documents"""
-    try:
-        retriever = db.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 4}
-        )
+def query_database(db: VectorStore, question: str,
+                   relevant_docs: Optional[List[Document]] = None,
+                   query_vector: Optional[List[float]] = None,
+                   placeholder=None,
+                   started_at: Optional[float] = None) -> tuple[str, list]:
+    """Query the database and return answer and relevant documents.
 
-        relevant_docs = retriever.get_relevant_documents(question)
+    Documents already retrieved during routing can be passed in directly;
+    otherwise the collection is searched once, reusing query_vector if given.
+    With a placeholder the answer is streamed into it token by token.
+    """
+    try:
+        if relevant_docs is None:
+            with span("retrieve", "vector_search", k=RETRIEVAL_K):
+                if query_vector is not None:
+                    relevant_docs = db.similarity_search_by_vector(query_vector, k=RETRIEVAL_K)
+                else:
+                    relevant_docs = db.similarity_search(question, k=RETRIEVAL_K)
 
         if relevant_docs:
             # Use simpler chain creation with hub prompt
@@ -250,44 +640,145 @@ def query_database(db: Qdrant, question: str) -> tuple[str, list]:
                 ("human", "Please provide your answer:"),
             ])
             combine_docs_chain = create_stuff_documents_chain(st.session_state.llm, retrieval_qa_prompt)
-            retrieval_chain = create_retrieval_chain(retriever, combine_docs_chain)
             
-            response = retrieval_chain.invoke({"input": question})
-            return response['answer'], relevant_docs
+            chain_input = {"input": question, "context": relevant_docs}
+            with span("generate_answer", "llm", documents=len(relevant_docs),
+                      streaming=placeholder is not None):
+                if placeholder is not None:
+                    answer = render_stream(combine_docs_chain.stream(chain_input), placeholder, started_at)
+                else:
+                    answer = combine_docs_chain.invoke(chain_input)
+            return answer, relevant_docs
         
         raise ValueError("No relevant documents found in database")
 
     except Exception as e:
         st.error(f"Error: {str(e)}")
-        return "I encountered an error. Please try rephrasing your question.", []
+        answer = "I encountered an error. Please try rephrasing your question."
+        if placeholder is not None:
+            placeholder.write(answer)
+        return answer, []
+
+def _handle_web_fallback(question: str, placeholder=None,
+                         started_at: Optional[float] = None) -> tuple[str, list]:
+    """Answer from the web research agent within WEB_FALLBACK_BUDGET_SECONDS.
 
-def _handle_web_fallback(question: str) -> tuple[str, list]:
+    Tokens are streamed into placeholder if given. When the budget runs out
+    the answer so far (or the search findings, or with neither a general LLM
+    answer) is returned, prefixed so that it is not stored in the semantic cache.
+    """
     st.info("No relevant documents found. Searching web...")
-    fallback_agent = create_fallback_agent(st.session_state.llm)
-    
-    with st.spinner('Researching...'):
-        agent_input = {
-            "messages": [
-                HumanMessage(content=f"Research and provide a detailed answer for: '{question}'")
-            ],
-            "is_last_step": False
-        }
-        
-        try:
-            response = fallback_agent.invoke(agent_input, config={"recursion_limit": 100})
-            if isinstance(response, dict) and "messages" in response:
-                answer = response["messages"][-1].content
-                return f"Web Search Result:\n{answer}", []
-                
-        except Exception:
-            # Fallback to general LLM response
-            fallback_response = st.session_state.llm.invoke(question).content
-            return f"Web search unavailable. General response: {fallback_response}", []
+    with span("web_fallback", "web_search") as fallback_span:
+        answer = _run_web_fallback(question, placeholder, started_at)
+        fallback_span.attrs["partial"] = answer.startswith("Partial")
+    return answer, []
+
+def _general_response(question: str, placeholder, started_at: Optional[float]) -> str:
+    """Fallback to general LLM response when the web research has nothing to offer"""
+    if placeholder is not None:
+        fallback_response = render_stream(
+            (chunk.content for chunk in st.session_state.llm.stream(question)),
+            placeholder, started_at
+        )
+    else:
+        fallback_response = st.session_state.llm.invoke(question).content
+    return f"Web search unavailable. General response: {fallback_response}"
+
+def _run_web_fallback(question: str, placeholder, started_at: Optional[float]) -> str:
+    """Run the research agent and return the prefixed answer text"""
+    run = get_web_fallback(st.session_state.openai_api_key).start(question)
+
+    try:
+        if placeholder is not None:
+            answer = render_stream(run, placeholder, started_at)
+        else:
+            with st.spinner('Researching...'):
+                answer = "".join(run)
+    except Exception as e:
+        if not run.findings:
+            return _general_response(question, placeholder, started_at)
+        st.error(f"Web research failed: {e}. Showing the search findings so far.")
+    else:
+        if not run.timed_out:
+            return f"Web Search Result:\n{answer}"
+        if not run.partial_answer():
+            st.warning(f"Web research found nothing within {WEB_FALLBACK_BUDGET_SECONDS:.0f}s; "
+                       f"answering without it.")
+            return _general_response(question, placeholder, started_at)
+        st.warning(f"Web research stopped after {WEB_FALLBACK_BUDGET_SECONDS:.0f}s; "
+                   f"the answer may be incomplete.")
+
+    answer = run.partial_answer()
+    if placeholder is not None:
+        placeholder.markdown(answer)
+    return f"Partial Web Search Result:\n{answer}"
+
+def answer_question(question: str):
+    """Answer one question: semantic cache, routing, then the database or the web"""
+    started_at = time.perf_counter()
+    with st.spinner('Finding answer...'):
+        cache = get_semantic_cache(get_store_key())
+        with span("embed_query", "embedding"):
+            query_vector = st.session_state.embeddings.embed_query(question)
+        with span("semantic_cache_lookup", "cache") as lookup:
+            cached = cache.lookup(query_vector)
+            lookup.attrs["hit"] = cached is not None
+        if cached is not None:
+            source = COLLECTIONS[cached.db_type].name if cached.db_type else "web search"
+            st.success(f"Answered from semantic cache ({source})")
+            st.write("### Answer")
+            st.write(cached.answer)
+            return
+
+        # Route the question
+        routing = route_query(question, query_vector=query_vector)
+        collection_type = routing.db_type
+
+    streaming = st.session_state.stream_answers
+    if collection_type is None:
+        # Use web search fallback directly
+        if streaming:
+            st.write("### Answer (from web search)")
+            answer, relevant_docs = _handle_web_fallback(question, st.empty(), started_at)
+        else:
+            answer, relevant_docs = _handle_web_fallback(question)
+            st.write("### Answer (from web search)")
+            st.write(answer)
+        if answer and answer.startswith("Web Search Result"):
+            cache.store(query_vector, None, answer)
+    else:
+        # Display routing information and query the database
+        st.info(f"Routing question to: {COLLECTIONS[collection_type].name}")
+        db = st.session_state.databases[collection_type]
+        relevant_docs = routing.documents(collection_type) or None
+        if streaming:
+            st.write("### Answer")
+            answer, relevant_docs = query_database(
+                db,
+                question,
+                relevant_docs=relevant_docs,
+                query_vector=routing.query_vector,
+                placeholder=st.empty(),
+                started_at=started_at
+            )
+        else:
+            with st.spinner('Generating answer...'):
+                answer, relevant_docs = query_database(
+                    db,
+                    question,
+                    relevant_docs=relevant_docs,
+                    query_vector=routing.query_vector
+                )
+            st.write("### Answer")
+            st.write(answer)
+        if relevant_docs:
+            cache.store(query_vector, collection_type, answer, relevant_docs)
 
 def main():
     """Main application function."""
     st.set_page_config(page_title="RAG Agent with Database Routing", page_icon="��")
     st.title("📠 RAG Agent with Database Routing")
+    start_metrics_server()
     
     # Sidebar for API keys and configuration
     with st.sidebar:
@@ -301,33 +792,53 @@ def main():
             key="api_key_input"
         )
         
-        # Qdrant Configuration
-        qdrant_url = st.text_input(
-            "Enter Qdrant URL:",
-            value=st.session_state.qdrant_url,
-            help="Example: https://your-cluster.qdrant.tech"
+        # Vector store backend
+        st.session_state.vector_backend = st.radio(
+            "Vector store",
+            ["qdrant", "local"],
+            index=["qdrant", "local"].index(st.session_state.vector_backend),
+            format_func=lambda backend: "Qdrant" if backend == "qdrant" else "Local (offline)",
+            horizontal=True,
+            help=f"The local store keeps vectors in memory-mapped files under {PERSIST_DIRECTORY}/"
         )
         
-        qdrant_api_key = st.text_input(
-            "Enter Qdrant API Key:",
-            type="password",
-            value=st.session_state.qdrant_api_key
+        st.session_state.collection_layout = st.radio(
+            "Collection layout",
+            ["separate", "shared"],
+            index=["separate", "shared"].index(st.session_state.collection_layout),
+            format_func=lambda layout: "One per domain" if layout == "separate" else "Shared, filtered by domain",
+            horizontal=True,
+            help="The shared layout searches one collection once per question, however many domains exist"
         )
         
+        if st.session_state.vector_backend == "qdrant":
+            # Qdrant Configuration
+            qdrant_url = st.text_input(
+                "Enter Qdrant URL:",
+                value=st.session_state.qdrant_url,
+                help="Example: https://your-cluster.qdrant.tech"
+            )
+            
+            qdrant_api_key = st.text_input(
+                "Enter Qdrant API Key:",
+                type="password",
+                value=st.session_state.qdrant_api_key
+            )
+            
+            if qdrant_url:
+                st.session_state.qdrant_url = qdrant_url
+            if qdrant_api_key:
+                st.session_state.qdrant_api_key = qdrant_api_key
+        
         # Update session state
         if api_key:
             st.session_state.openai_api_key = api_key
-        if qdrant_url:
-            st.session_state.qdrant_url = qdrant_url
-        if qdrant_api_key:
-            st.session_state.qdrant_api_key = qdrant_api_key
             
         # Initialize models if all credentials are provided
-        if (st.session_state.openai_api_key and 
-            st.session_state.qdrant_url and 
-            st.session_state.qdrant_api_key):
+        if has_credentials():
             if initialize_models():
-                st.success("Connected to OpenAI and Qdrant successfully!")
+                backend_name = "Qdrant" if st.session_state.vector_backend == "qdrant" else "the local vector store"
+                st.success(f"Connected to OpenAI and {backend_name} successfully!")
             else:
                 st.error("Failed to initialize. Please check your credentials.")
         else:
@@ -336,6 +847,62 @@ def main():
 
         st.markdown("---")
 
+        st.session_state.stream_answers = st.toggle(
+            "Stream answers",
+            value=st.session_state.stream_answers,
+            help="Show the answer token by token as it is generated"
+        )
+        st.session_state.debug_panel = st.toggle(
+            "Debug panel",
+            value=st.session_state.debug_panel,
+            help="Show the per-stage timings of the last question or upload"
+        )
+
+        with st.expander("Semantic cache"):
+            cache = get_semantic_cache(get_store_key())
+            cache.threshold = st.slider(
+                "Similarity threshold",
+                0.80, 1.0,
+                value=float(cache.threshold),
+                step=0.01,
+                help="Minimum cosine similarity between questions to reuse a cached answer"
+            )
+            stats = cache.stats()
+            st.write(f"Entries: {stats['entries']} · Hits: {stats['hits']} · "
+                     f"Misses: {stats['misses']} · Hit rate: {stats['hit_rate']:.0%}")
+            st.write(f"Evictions: {stats['evictions']} · Invalidations: {stats['invalidations']}")
+            if st.button("Clear cache"):
+                cache.clear()
+
+        with st.expander("Web search cache"):
+            if st.session_state.openai_api_key:
+                search_stats = get_web_fallback(st.session_state.openai_api_key).cache.stats()
+                st.write(f"Entries: {search_stats['entries']} · "
+                         f"Hits: {search_stats['hits']} · Misses: {search_stats['misses']} · "
+                         f"Hit rate: {search_stats['hit_rate']:.0%}")
+
+        with st.expander("Embedding cache"):
+            embedding_stats = get_embedding_cache().stats()
+            st.write(f"Entries: {embedding_stats['entries']} · "
+                     f"Size: {embedding_stats['size_bytes'] / 1_048_576:.1f} MB")
+            st.write(f"Hits: {embedding_stats['hits']} · Misses: {embedding_stats['misses']} · "
+                     f"Hit rate: {embedding_stats['hit_rate']:.0%}")
+
+        with st.expander("Admin"):
+            reset_type = st.selectbox(
+                "Collection",
+                list(COLLECTIONS.keys()),
+                format_func=lambda db_type: COLLECTIONS[db_type].name,
+                key="reset_collection_type"
+            )
+            confirm_reset = st.checkbox("I understand this deletes all documents in the collection")
+            if st.button("Reset collection", disabled=not confirm_reset):
+                try:
+                    reset_collection(reset_type)
+                    st.success(f"Collection {COLLECTIONS[reset_type].collection_name} was reset")
+                except Exception as e:
+                    st.error(f"Failed to reset collection: {str(e)}")
+
     st.header("Document Upload")
     st.info("Upload documents to populate the databases. Each tab corresponds to a different database.")
     tabs = st.tabs([collection_config.name for collection_config in COLLECTIONS.values()])
@@ -352,24 +919,28 @@ def main():
             
             if uploaded_files:
                 with st.spinner('Processing documents...'):
-                    all_texts = []
-                    for uploaded_file in uploaded_files:
-                        texts = process_document(uploaded_file)
-                        all_texts.extend(texts)
-                    
-                    if all_texts:
-                        db = st.session_state.databases[collection_type]
-                        # Belgeleri daha küçük gruplar halinde ekle
-                        batch_size = 50  # Her seferde 50 belge ekle
-                        for i in range(0, len(all_texts), batch_size):
-                            batch = all_texts[i:i + batch_size]
-                            try:
-                                with st.spinner(f'Adding documents batch {i//batch_size + 1}/{len(all_texts)//batch_size + 1}...'):
-                                    db.add_documents(batch)
-                            except Exception as e:
-                                st.error(f"Error adding batch {i//batch_size + 1}: {str(e)}")
-                                continue
-                        st.success("Documents processed and added to the database!")
+                    progress_text = st.empty()
+                    with start_trace("upload") as trace:
+                        stats = ingest_files(
+                            collection_type,
+                            uploaded_files,
+                            progress=lambda stats: progress_text.caption(stats.summary())
+                        )
+                    if stats.files:
+                        st.session_state.last_trace = trace
+                    for error in stats.errors:
+                        st.error(error)
+                    if stats.vectors:
+                        st.success(f"Documents processed and added to the database! "
+                                   f"({stats.summary()} in {stats.elapsed:.1f}s)")
+
+            indexed = get_ingestion_manifest(get_store_key()).entries(
+                collection_config.collection_name
+            )
+            with st.expander(f"Indexed documents ({len(indexed)})"):
+                for entry in indexed:
+                    st.write(f"📄 {entry['name']} · {entry['pages']} pages · "
+                             f"{entry['chunks']} chunks · {entry['ingested_at']}")
     
     # Query section
     st.header("Ask Questions")
@@ -377,22 +948,12 @@ def main():
     question = st.text_input("Enter your question:")
     
     if question:
-        with st.spinner('Finding answer...'):
-            # Route the question
-            collection_type = route_query(question)
-            
-            if collection_type is None:
-                # Use web search fallback directly
-                answer, relevant_docs = _handle_web_fallback(question)
-                st.write("### Answer (from web search)")
-                st.write(answer)
-            else:
-                # Display routing information and query the database
-                st.info(f"Routing question to: {COLLECTIONS[collection_type].name}")
-                db = st.session_state.databases[collection_type]
-                answer, relevant_docs = query_database(db, question)
-                st.write("### Answer")
-                st.write(answer)
+        with start_trace("question") as trace:
+            answer_question(question)
+        st.session_state.last_trace = trace
+
+    if st.session_state.debug_panel:
+        render_trace(st.session_state.last_trace)
 
 if __name__ == "__main__":
     main()
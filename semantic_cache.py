@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+@dataclass
+class CacheEntry:
+    vector: np.ndarray
+    db_type: Optional[str]  # None for answers that came from web search
+    answer: str
+    documents: List[Any] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+
+
+class SemanticCache:
+    """Answer cache keyed on query embeddings.
+
+    A lookup hits when the cosine similarity between the query and a stored
+    query is at least `threshold`. Entries expire after `ttl_seconds` and the
+    least recently used entry is evicted once `max_entries` is reached.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 256, ttl_seconds: float = 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._next_key = 0
+        self._keys: List[int] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items()
+                   if now - entry.created_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self.evictions += len(expired)
+            self._matrix = None
+
+    def _ensure_matrix(self):
+        if self._matrix is None:
+            self._keys = list(self._entries.keys())
+            self._matrix = (np.stack([self._entries[key].vector for key in self._keys])
+                            if self._keys else np.empty((0, 0), dtype=np.float32))
+
+    def lookup(self, query_vector: Sequence[float]) -> Optional[CacheEntry]:
+        """Return the most similar live entry above the threshold, if any"""
+        query = self._normalize(query_vector)
+        with self._lock:
+            self._expire(time.time())
+            self._ensure_matrix()
+            if self._keys:
+                similarities = self._matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key = self._keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]
+            self.misses += 1
+            return None
+
+    def store(self, query_vector: Sequence[float], db_type: Optional[str],
+              answer: str, documents: Optional[List[Any]] = None):
+        """Remember the routed collection and answer for a query"""
+        entry = CacheEntry(self._normalize(query_vector), db_type, answer, list(documents or []))
+        with self._lock:
+            self._entries[self._next_key] = entry
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def invalidate(self, db_type: str):
+        """Drop entries routed to db_type and web-search answers.
+
+        Web-search answers are dropped too, because new documents may let
+        those questions be answered from the collection instead.
+        """
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if entry.db_type in (db_type, None)]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self.invalidations += len(stale)
+                self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,116 @@
+from dataclasses import dataclass
+from typing import Dict, Literal, Optional, Sequence
+
+import numpy as np
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Disabled,
+    Distance,
+    HnswConfigDiff,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParams,
+)
+
+FULL_DIMENSIONS = 1536  # text-embedding-3-small
+
+
+def project_vector(vector: Sequence[float], dimensions: Optional[int]) -> list:
+    """Shorten an embedding to `dimensions` and re-normalize it.
+
+    text-embedding-3 models are trained so that a truncated, re-normalized
+    embedding is what the API returns for a shorter `dimensions` request, so
+    one full-size embedding can serve collections of every size.
+    """
+    if not dimensions or len(vector) <= dimensions:
+        return list(vector)
+    shortened = np.asarray(vector[:dimensions], dtype=np.float32)
+    norm = np.linalg.norm(shortened)
+    return (shortened / norm if norm else shortened).tolist()
+
+
+@dataclass(frozen=True)
+class StorageProfile:
+    """How a collection stores and searches its vectors.
+
+    quantization:  None, "scalar" (int8) or "binary". Quantized vectors are
+                   kept in RAM and the results are rescored with the originals.
+    on_disk:       keep the original float32 vectors on disk instead of RAM.
+    oversampling:  how many extra candidates quantized search fetches before
+                   rescoring, as a multiple of k.
+    hnsw_ef:       query-time HNSW beam width; None uses the server default.
+    """
+    name: str
+    dimensions: int = FULL_DIMENSIONS
+    quantization: Optional[Literal["scalar", "binary"]] = None
+    on_disk: bool = False
+    hnsw_m: int = 16
+    hnsw_ef_construct: int = 100
+    hnsw_ef: Optional[int] = None
+    rescore: bool = True
+    oversampling: Optional[float] = None
+
+    def vector_params(self, distance: Distance = Distance.COSINE) -> VectorParams:
+        return VectorParams(size=self.dimensions, distance=distance, on_disk=self.on_disk)
+
+    def hnsw_config(self) -> HnswConfigDiff:
+        return HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct)
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+            )
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def search_params(self) -> Optional[SearchParams]:
+        if self.quantization is None and self.hnsw_ef is None:
+            return None
+        quantization = None
+        if self.quantization is not None:
+            quantization = QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        return SearchParams(hnsw_ef=self.hnsw_ef, quantization=quantization)
+
+    def needs_update(self, collection_config) -> bool:
+        """Whether an existing collection's HNSW or quantization settings differ"""
+        hnsw = collection_config.hnsw_config
+        if hnsw.m != self.hnsw_m or hnsw.ef_construct != self.hnsw_ef_construct:
+            return True
+        current = collection_config.quantization_config
+        expected = self.quantization_config()
+        return type(current) is not type(expected)
+
+    def update_kwargs(self) -> dict:
+        """Arguments for QdrantClient.update_collection applying this profile"""
+        return {
+            "hnsw_config": self.hnsw_config(),
+            "quantization_config": self.quantization_config() or Disabled.DISABLED,
+        }
+
+    def memory_per_vector(self) -> Dict[str, float]:
+        """Approximate bytes per point held in RAM and on disk"""
+        original = self.dimensions * 4
+        quantized = {"scalar": self.dimensions, "binary": self.dimensions / 8}.get(self.quantization, 0)
+        graph = self.hnsw_m * 2 * 4  # level-0 links dominate the HNSW graph
+        ram = quantized + graph + (0 if self.on_disk else original)
+        return {"ram": ram, "disk": original if self.on_disk else 0}
+
+
+STORAGE_PROFILES: Dict[str, StorageProfile] = {
+    # Full-size float32 vectors in RAM, default HNSW settings
+    "exact": StorageProfile(name="exact"),
+    # int8 copies in RAM, originals on disk for rescoring
+    "int8": StorageProfile(name="int8", quantization="scalar", on_disk=True, oversampling=2.0),
+    # Shortened 512-dim embeddings with int8 quantization
+    "int8-512": StorageProfile(name="int8-512", dimensions=512, quantization="scalar",
+                               on_disk=True, oversampling=2.0),
+    # 1 bit per dimension in RAM, heavy oversampling to recover recall
+    "binary": StorageProfile(name="binary", quantization="binary", on_disk=True,
+                             oversampling=3.0, hnsw_ef=128),
+}
@@ -0,0 +1,263 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+@dataclass
+class Span:
+    name: str
+    kind: str  # embedding, vector_search, llm, db, web_search, cache, ...
+    start: float  # seconds since the start of the trace
+    duration: float = 0.0
+    depth: int = 0
+    error: Optional[str] = None
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Trace:
+    """Spans recorded while handling one request, e.g. one question"""
+    name: str
+    started_at: float = field(default_factory=time.time)
+    duration: float = 0.0
+    spans: List[Span] = field(default_factory=list)
+    _origin: float = field(default_factory=time.perf_counter, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def totals(self) -> Dict[str, float]:
+        """Seconds spent per span kind, counting only top-level spans of each kind"""
+        totals: Dict[str, float] = defaultdict(float)
+        with self._lock:
+            for span in self.spans:
+                if not any(other.kind == span.kind and other.depth < span.depth
+                           and other.start <= span.start < other.start + other.duration
+                           for other in self.spans):
+                    totals[span.kind] += span.duration
+        return dict(totals)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [asdict(span) for span in sorted(self.spans, key=lambda span: span.start)]
+        return {"trace": self.name, "started_at": self.started_at,
+                "duration": self.duration, "spans": spans}
+
+
+class Metrics:
+    """Process-wide span latency histograms and error counters"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], List[float]] = {}  # bucket counts, then sum, count
+        self._errors: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def observe(self, metric: str, labels: Tuple[str, str], seconds: float, error: bool = False):
+        key = (metric,) + labels
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            if error:
+                self._errors[key] += 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Count, sum and error count per metric and labels"""
+        with self._lock:
+            return {
+                "/".join(key): {"count": h[-1], "sum": h[-2], "errors": self._errors.get(key, 0)}
+                for key, h in self._histograms.items()
+            }
+
+    def to_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            items = sorted(self._histograms.items())
+            errors = dict(self._errors)
+        for metric, label_names in (("rag_span", ("name", "kind")), ("rag_trace", ("name", "status"))):
+            series = [(key[1:], h) for key, h in items if key[0] == metric]
+            if not series:
+                continue
+            lines.append(f"# HELP {metric}_duration_seconds Latency of {metric.split('_')[1]}s")
+            lines.append(f"# TYPE {metric}_duration_seconds histogram")
+            for labels, h in series:
+                label_text = ",".join(f'{n}="{v}"' for n, v in zip(label_names, labels))
+                for bound, count in zip(self.buckets, h):
+                    lines.append(f'{metric}_duration_seconds_bucket{{{label_text},le="{bound}"}} {count}')
+                lines.append(f'{metric}_duration_seconds_bucket{{{label_text},le="+Inf"}} {h[-1]}')
+                lines.append(f"{metric}_duration_seconds_sum{{{label_text}}} {h[-2]:.6f}")
+                lines.append(f"{metric}_duration_seconds_count{{{label_text}}} {h[-1]}")
+            lines.append(f"# TYPE {metric}_errors_total counter")
+            for labels, _ in series:
+                label_text = ",".join(f'{n}="{v}"' for n, v in zip(label_names, labels))
+                lines.append(f"{metric}_errors_total{{{label_text}}} {errors.get((metric,) + labels, 0)}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_current_depth: contextvars.ContextVar[int] = contextvars.ContextVar("current_depth", default=0)
+_export_lock = threading.Lock()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name: str) -> Iterator[Trace]:
+    """Collect the spans of one request.
+
+    Finished traces are appended to the JSON lines file named by the
+    TRACE_JSONL_PATH environment variable, if it is set.
+    """
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    failed = False
+    try:
+        yield trace
+    except Exception:
+        failed = True
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.duration = time.perf_counter() - trace._origin
+        METRICS.observe("rag_trace", (name, "error" if failed else "ok"), trace.duration, failed)
+        path = os.getenv("TRACE_JSONL_PATH")
+        if path:
+            with _export_lock, open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+
+
+@contextmanager
+def span(name: str, kind: str, trace: Optional[Trace] = None, **attrs) -> Iterator[Span]:
+    """Time a block as one stage of the current trace.
+
+    The duration always feeds the process-wide metrics; the span itself is
+    only kept when a trace is active or passed in explicitly (e.g. from a
+    worker thread). Attributes can be added to the yielded span while the
+    block runs.
+    """
+    trace = trace or _current_trace.get()
+    depth = _current_depth.get()
+    origin = trace._origin if trace else time.perf_counter()
+    started = time.perf_counter()
+    record = Span(name, kind, start=started - origin, depth=depth, attrs=attrs)
+    token = _current_depth.set(depth + 1)
+    try:
+        yield record
+    except Exception as e:
+        record.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_depth.reset(token)
+        record.duration = time.perf_counter() - started
+        METRICS.observe("rag_span", (name, kind), record.duration, record.error is not None)
+        if trace is not None:
+            trace.add(record)
+
+
+def traced(name: str, kind: str):
+    """Decorator recording every call of a function as a span"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def in_current_context(fn):
+    """Bind fn to a copy of the caller's context, so spans it records on a
+    worker thread join the caller's trace. Use one wrapper per submitted call."""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+_server_lock = threading.Lock()
+_server: Optional[ThreadingHTTPServer] = None
+_server_failed = False
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None) -> Optional[ThreadingHTTPServer]:
+    """Serve METRICS at http://<host>:<port>/metrics on a daemon thread.
+
+    The port defaults to the METRICS_PORT environment variable; nothing is
+    started without one. The host defaults to METRICS_HOST, else 127.0.0.1.
+    If the port can't be bound (e.g. another app already uses it), a warning
+    is logged once and the app runs without the exporter. Safe to call on
+    every Streamlit rerun.
+    """
+    global _server, _server_failed
+    port = port or int(os.getenv("METRICS_PORT") or 0)
+    if not port:
+        return None
+    host = host or os.getenv("METRICS_HOST") or "127.0.0.1"
+    with _server_lock:
+        if _server is None and not _server_failed:
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = METRICS.to_prometheus().encode("utf-8")
+                    self.send_response(200 if self.path.startswith("/metrics") else 404)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.end_headers()
+                    self.wfile.write(body if self.path.startswith("/metrics") else b"")
+
+                def log_message(self, *args):
+                    pass
+
+            try:
+                _server = ThreadingHTTPServer((host, port), Handler)
+            except OSError as e:
+                _server_failed = True
+                logging.getLogger(__name__).warning(
+                    "Metrics exporter disabled, could not listen on %s:%s: %s", host, port, e)
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
+
+
+def render_trace(trace: Optional[Trace], title: str = "Debug: request trace"):
+    """Streamlit panel with the spans of a trace and the current metrics"""
+    import streamlit as st
+
+    with st.expander(title):
+        if trace is None:
+            st.caption("No request traced yet.")
+        else:
+            st.write(f"**{trace.name}** · {trace.duration * 1000:.0f} ms total")
+            st.write(" · ".join(f"{kind}: {seconds * 1000:.0f} ms"
+                                for kind, seconds in sorted(trace.totals().items(),
+                                                            key=lambda item: -item[1])))
+            st.dataframe([
+                {
+                    "stage": "  " * span.depth + span.name,
+                    "kind": span.kind,
+                    "start ms": round(span.start * 1000, 1),
+                    "duration ms": round(span.duration * 1000, 1),
+                    "error": span.error or "",
+                    "details": ", ".join(f"{k}={v}" for k, v in span.attrs.items()),
+                }
+                for span in sorted(trace.spans, key=lambda span: span.start)
+            ], use_container_width=True)
+        st.download_button("Download metrics (Prometheus)", METRICS.to_prometheus(),
+                           file_name="metrics.prom", mime="text/plain", key=f"metrics_{title}")
@@ -0,0 +1,454 @@
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_community.vectorstores import Qdrant
+from qdrant_client.models import FieldCondition, Filter, MatchValue, PointIdsList, PointStruct, SearchParams
+
+from storage_profiles import project_vector
+
+SearchHits = List[Tuple[Document, float]]
+
+# Both stores below expose the same small interface on top of LangChain's
+# VectorStore, which the routing app uses for ingestion and bookkeeping:
+#   upsert_embeddings(ids, vectors, documents)  store already-embedded chunks
+#   ids_where(conditions)                       point IDs whose metadata matches
+#   get_vectors(ids)                            stored vectors of existing points
+#   delete(ids)                                 remove points
+#   count(conditions)                           number of (matching) points
+#   iter_vectors(batch_size, conditions)        stored vectors, in batches
+#   grouped_search(embedding, group_by, ...)    best hits per metadata value
+#
+# `conditions` are metadata equality matches such as {"source": "a.pdf"}.
+# Vectors longer than a store's dimensions are shortened with project_vector,
+# so callers can always pass full-size embeddings.
+
+
+class QdrantStore(Qdrant):
+    """LangChain Qdrant wrapper with the shared ingestion interface.
+
+    `search_params` (e.g. HNSW ef or quantization rescoring) are applied to
+    every search that does not pass its own.
+    """
+
+    def __init__(self, *args: Any, dimensions: Optional[int] = None,
+                 search_params: Optional[SearchParams] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.dimensions = dimensions
+        self.search_params = search_params
+
+    def upsert_embeddings(self, ids: List[str], vectors: List[List[float]], documents: List[Document]):
+        points = [
+            PointStruct(
+                id=point_id,
+                vector=project_vector(vector, self.dimensions),
+                payload={
+                    self.content_payload_key: doc.page_content,
+                    self.metadata_payload_key: doc.metadata
+                }
+            )
+            for point_id, vector, doc in zip(ids, vectors, documents)
+        ]
+        self.client.upsert(collection_name=self.collection_name, points=points)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Any] = None,
+                                               search_params: Optional[SearchParams] = None,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        return super().similarity_search_with_score_by_vector(
+            project_vector(embedding, self.dimensions),
+            k=k,
+            filter=filter,
+            search_params=search_params or self.search_params,
+            **kwargs
+        )
+
+    def _metadata_filter(self, conditions: Optional[Dict[str, Any]]) -> Optional[Filter]:
+        if not conditions:
+            return None
+        return Filter(must=[
+            FieldCondition(key=f"{self.metadata_payload_key}.{key}", match=MatchValue(value=value))
+            for key, value in conditions.items()
+        ])
+
+    def grouped_search(self, embedding: List[float], group_by: str, group_size: int, limit: int,
+                       conditions: Optional[Dict[str, Any]] = None) -> Dict[Any, SearchHits]:
+        """Top `group_size` hits for each of up to `limit` values of metadata[group_by], in one request"""
+        result = self.client.search_groups(
+            collection_name=self.collection_name,
+            query_vector=project_vector(embedding, self.dimensions),
+            group_by=f"{self.metadata_payload_key}.{group_by}",
+            limit=limit,
+            group_size=group_size,
+            query_filter=self._metadata_filter(conditions),
+            search_params=self.search_params,
+            with_payload=True
+        )
+        return {
+            group.id: [
+                (Document(page_content=hit.payload.get(self.content_payload_key, ""),
+                          metadata=hit.payload.get(self.metadata_payload_key) or {}),
+                 hit.score)
+                for hit in group.hits
+            ]
+            for group in result.groups
+        }
+
+    def _scroll(self, scroll_filter: Optional[Filter] = None, with_vectors: bool = False,
+                batch_size: int = 1024) -> Iterator[list]:
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                limit=batch_size,
+                offset=offset,
+                with_payload=False,
+                with_vectors=with_vectors
+            )
+            yield points
+            if offset is None:
+                return
+
+    def ids_where(self, conditions: Dict[str, Any]) -> List[str]:
+        return [str(point.id) for points in self._scroll(self._metadata_filter(conditions)) for point in points]
+
+    def get_vectors(self, ids: List[str]) -> List[List[float]]:
+        points = self.client.retrieve(collection_name=self.collection_name, ids=ids, with_vectors=True)
+        return [point.vector for point in points]
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """Delete the given points; without ids nothing is deleted and False is returned (use reset)"""
+        if ids is None:
+            return False
+        if ids:
+            self.client.delete(collection_name=self.collection_name, points_selector=PointIdsList(points=ids))
+        return True
+
+    def count(self, conditions: Optional[Dict[str, Any]] = None) -> int:
+        return self.client.count(
+            self.collection_name, count_filter=self._metadata_filter(conditions), exact=True
+        ).count
+
+    def iter_vectors(self, batch_size: int = 256,
+                     conditions: Optional[Dict[str, Any]] = None) -> Iterator[List[List[float]]]:
+        for points in self._scroll(self._metadata_filter(conditions), with_vectors=True, batch_size=batch_size):
+            yield [point.vector for point in points]
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector store backed by a memory-mapped float32 matrix.
+
+    Vectors are shortened to `dim`, normalized on write and kept in
+    `vectors.f32` under `path`;
+    page content and metadata live in a `payloads.json` sidecar. Search is an
+    exact top-k cosine similarity computed with one NumPy matrix product, so
+    scores are comparable to a Qdrant collection using cosine distance.
+
+    The sidecar is rewritten on every change, which suits the small
+    collections this store is meant for.
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, path: str, embedding: Embeddings, dim: int):
+        self.path = path
+        self.dim = dim
+        self._embedding = embedding
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        meta_path = os.path.join(path, "meta.json")
+        capacity = self.INITIAL_CAPACITY
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["dim"] != dim:
+                raise ValueError(
+                    f"Local store {path} has vectors of size {meta['dim']}, expected {dim}. "
+                    "Reset the collection to rebuild it."
+                )
+            capacity = meta["capacity"]
+
+        self._rows: List[Optional[dict]] = []
+        payloads_path = os.path.join(path, "payloads.json")
+        if os.path.exists(payloads_path):
+            with open(payloads_path, encoding="utf-8") as f:
+                self._rows = json.load(f)
+        self._vectors = self._open_matrix(capacity)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._ids: Dict[str, int] = {}
+        for i, row in enumerate(self._rows):
+            if row is not None:
+                self._ids[row["id"]] = i
+                self._alive[i] = True
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @property
+    def _capacity(self) -> int:
+        return self._vectors.shape[0]
+
+    def _open_matrix(self, capacity: int) -> np.memmap:
+        vectors_path = os.path.join(self.path, "vectors.f32")
+        size = capacity * self.dim * 4
+        with open(vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _grow(self, needed: int):
+        if needed <= self._capacity:
+            return
+        capacity = max(needed, self._capacity * 2)
+        self._vectors.flush()
+        self._vectors = self._open_matrix(capacity)
+        self._alive = np.concatenate([self._alive, np.zeros(capacity - len(self._alive), dtype=bool)])
+
+    def _save(self):
+        self._vectors.flush()
+        for name, data in (("payloads.json", self._rows),
+                           ("meta.json", {"dim": self.dim, "capacity": self._capacity})):
+            target = os.path.join(self.path, name)
+            with open(f"{target}.tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(f"{target}.tmp", target)
+
+    def _compact(self):
+        """Drop deleted rows once they make up more than half of the matrix"""
+        deleted = len(self._rows) - len(self._ids)
+        if deleted <= max(len(self._ids), self.INITIAL_CAPACITY):
+            return
+        keep = np.flatnonzero(self._alive[:len(self._rows)])
+        self._vectors[:len(keep)] = self._vectors[keep]
+        self._rows = [self._rows[i] for i in keep]
+        self._alive[:] = False
+        self._alive[:len(keep)] = True
+        self._ids = {row["id"]: i for i, row in enumerate(self._rows)}
+
+    def _normalize(self, vectors: Iterable[List[float]]) -> np.ndarray:
+        matrix = np.asarray(list(vectors), dtype=np.float32)[..., :self.dim]
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def upsert_embeddings(self, ids: List[str], vectors: List[List[float]], documents: List[Document]):
+        if not ids:
+            return
+        matrix = self._normalize(vectors).reshape(-1, self.dim)
+        with self._lock:
+            for point_id, vector, doc in zip(ids, matrix, documents):
+                row = self._ids.get(point_id)
+                if row is None:
+                    row = len(self._rows)
+                    self._grow(row + 1)
+                    self._rows.append(None)
+                    self._ids[point_id] = row
+                self._vectors[row] = vector
+                self._alive[row] = True
+                self._rows[row] = {"id": point_id, "page_content": doc.page_content, "metadata": doc.metadata}
+            self._save()
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        self.upsert_embeddings(ids, self._embedding.embed_documents(texts), documents)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            return False
+        with self._lock:
+            for point_id in ids:
+                row = self._ids.pop(point_id, None)
+                if row is not None:
+                    self._rows[row] = None
+                    self._alive[row] = False
+            self._compact()
+            self._save()
+        return True
+
+    def reset(self):
+        """Remove every point and shrink the files back to the initial size"""
+        with self._lock:
+            self._rows, self._ids = [], {}
+            self._vectors = None  # release the mapping before removing the file
+            os.remove(os.path.join(self.path, "vectors.f32"))
+            self._vectors = self._open_matrix(self.INITIAL_CAPACITY)
+            self._alive = np.zeros(self.INITIAL_CAPACITY, dtype=bool)
+            self._save()
+
+    @staticmethod
+    def _matches(row: Optional[dict], conditions: Optional[Dict[str, Any]]) -> bool:
+        return row is not None and all(row["metadata"].get(key) == value
+                                       for key, value in (conditions or {}).items())
+
+    def _live_rows(self, conditions: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """Indices of stored rows matching conditions; call with the lock held"""
+        live = np.flatnonzero(self._alive[:len(self._rows)])
+        if conditions:
+            live = np.array([i for i in live if self._matches(self._rows[i], conditions)], dtype=np.int64)
+        return live
+
+    def count(self, conditions: Optional[Dict[str, Any]] = None) -> int:
+        if not conditions:
+            return len(self._ids)
+        with self._lock:
+            return len(self._live_rows(conditions))
+
+    def ids_where(self, conditions: Dict[str, Any]) -> List[str]:
+        with self._lock:
+            return [self._rows[i]["id"] for i in self._live_rows(conditions)]
+
+    def get_vectors(self, ids: List[str]) -> List[List[float]]:
+        with self._lock:
+            rows = [self._ids[point_id] for point_id in ids if point_id in self._ids]
+            return self._vectors[rows].tolist()
+
+    def iter_vectors(self, batch_size: int = 256,
+                     conditions: Optional[Dict[str, Any]] = None) -> Iterator[List[List[float]]]:
+        with self._lock:
+            live = self._live_rows(conditions)
+        for i in range(0, len(live), batch_size):
+            yield self._vectors[live[i:i + batch_size]].tolist()
+
+    def _scored_rows(self, embedding: List[float],
+                     conditions: Optional[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Candidate row indices and their cosine scores; call with the lock held"""
+        query = self._normalize([embedding])[0]
+        candidates = self._live_rows(conditions)
+        if not len(candidates):
+            return candidates, np.empty(0, dtype=np.float32)
+        return candidates, self._vectors[candidates] @ query
+
+    def _hit(self, row: int, score: float) -> Tuple[Document, float]:
+        payload = self._rows[row]
+        return Document(page_content=payload["page_content"], metadata=payload["metadata"]), float(score)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None,
+                                               **kwargs: Any) -> SearchHits:
+        with self._lock:
+            candidates, scores = self._scored_rows(embedding, filter)
+            if not len(candidates):
+                return []
+            k = min(k, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [self._hit(candidates[i], scores[i]) for i in top]
+
+    def grouped_search(self, embedding: List[float], group_by: str, group_size: int, limit: int,
+                       conditions: Optional[Dict[str, Any]] = None) -> Dict[Any, SearchHits]:
+        """Top `group_size` hits for each of up to `limit` values of metadata[group_by]"""
+        groups: Dict[Any, SearchHits] = {}
+        with self._lock:
+            candidates, scores = self._scored_rows(embedding, conditions)
+            for i in np.argsort(-scores):
+                value = self._rows[candidates[i]]["metadata"].get(group_by)
+                if value is None:
+                    continue
+                hits = groups.get(value)
+                if hits is None:
+                    if len(groups) == limit:
+                        continue
+                    hits = groups[value] = []
+                if len(hits) < group_size:
+                    hits.append(self._hit(candidates[i], scores[i]))
+                if len(groups) == limit and all(len(hits) == group_size for hits in groups.values()):
+                    break
+        return groups
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4,
+                          filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   path: str = "local_vector_store", dim: Optional[int] = None,
+                   **kwargs: Any) -> "LocalVectorStore":
+        texts = list(texts)
+        dim = dim or len(embedding.embed_query(texts[0] if texts else ""))
+        store = cls(path, embedding, dim)
+        store.add_texts(texts, metadatas, ids=kwargs.get("ids"))
+        return store
+
+
+class DomainView:
+    """One domain of a shared collection, presented like a separate store.
+
+    Searches and bookkeeping only see points whose metadata[`key`] equals
+    `domain`. Writes pass straight through, so documents must already carry
+    the domain in their metadata.
+    """
+
+    def __init__(self, store, domain: str, key: str = "domain"):
+        self.store = store
+        self.domain = domain
+        self.key = key
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.store.embeddings
+
+    def _with_domain(self, conditions: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        return {**(conditions or {}), self.key: self.domain}
+
+    def upsert_embeddings(self, ids: List[str], vectors: List[List[float]], documents: List[Document]):
+        self.store.upsert_embeddings(ids, vectors, documents)
+
+    def ids_where(self, conditions: Dict[str, Any]) -> List[str]:
+        return self.store.ids_where(self._with_domain(conditions))
+
+    def get_vectors(self, ids: List[str]) -> List[List[float]]:
+        return self.store.get_vectors(ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        return self.store.delete(ids)
+
+    def reset(self):
+        """Remove every point of this domain from the shared collection"""
+        ids = self.ids_where({})
+        if ids:
+            self.store.delete(ids)
+
+    def count(self, conditions: Optional[Dict[str, Any]] = None) -> int:
+        return self.store.count(self._with_domain(conditions))
+
+    def iter_vectors(self, batch_size: int = 256,
+                     conditions: Optional[Dict[str, Any]] = None) -> Iterator[List[List[float]]]:
+        return self.store.iter_vectors(batch_size, self._with_domain(conditions))
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None,
+                                               **kwargs: Any) -> SearchHits:
+        return self.store.similarity_search_with_score_by_vector(embedding, k=k, filter=self._with_domain(filter))
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search(self, query: str, k: int = 4,
+                          filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k, filter)
@@ -0,0 +1,234 @@
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain.schema import HumanMessage
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import AIMessage, ToolMessage
+from langgraph.prebuilt import create_react_agent
+
+from tracing import in_current_context, span
+
+_DONE = object()  # Queue sentinel marking the end of an agent run
+
+
+class SearchCache:
+    """TTL cache of web search results keyed by normalized query text"""
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 512):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+    def get(self, query: str) -> Optional[str]:
+        key = self.normalize(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query: str, results: str):
+        with self._lock:
+            key = self.normalize(query)
+            self._entries[key] = (time.time(), results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class FallbackRun:
+    """One time-bounded web research run, iterated for its answer tokens.
+
+    The agent runs on a worker thread and tokens are handed over through a
+    queue, so iteration stops when the budget is spent even if the agent is
+    still waiting on the model or a search. After iteration, `timed_out` says
+    whether the budget expired and `findings` holds the search results the
+    agent received.
+    """
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.text = ""
+        self.findings: List[str] = []
+        self.timed_out = False
+        self.error: Optional[BaseException] = None
+        self._queue: queue.Queue = queue.Queue()
+        self._stop = threading.Event()
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            while True:
+                remaining = self.deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timed_out = True
+                    return
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    self.timed_out = True
+                    return
+                if item is _DONE:
+                    break
+                self.text += item
+                yield item
+            if self.error is not None and not self.text:
+                raise self.error
+        finally:
+            self._stop.set()
+
+    def partial_answer(self, max_chars: int = 1500) -> str:
+        """Best answer available when the budget ran out before the agent finished"""
+        if self.text:
+            return self.text
+        if self.findings:
+            return "Search findings so far:\n" + "\n\n".join(self.findings)[:max_chars]
+        return ""
+
+
+class _TokenForwarder(BaseCallbackHandler):
+    """Hands the tokens of a streaming chat model over to a FallbackRun"""
+
+    def __init__(self, run: FallbackRun):
+        self.run = run
+        self.streamed = False  # Whether any token arrived since the last agent step
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token and not self.run._stop.is_set():
+            self.streamed = True
+            self.run._queue.put(token)
+
+
+class WebFallback:
+    """Web research agent built once and shared by every question.
+
+    The agent's single tool takes several search queries and runs them
+    concurrently, with results cached by normalized query. Each run has a
+    wall-clock budget of `budget_seconds`; individual searches give up after
+    `search_timeout` and the agent may take at most `recursion_limit` steps.
+
+    Answer tokens are forwarded through a callback as the model streams them,
+    so pass a chat model created with streaming=True; otherwise each answer
+    arrives as one piece when the agent finishes.
+    """
+
+    def __init__(self, chat_model: BaseLanguageModel,
+                 search_fn: Callable[[str], str],
+                 cache: Optional[SearchCache] = None,
+                 budget_seconds: float = 20.0,
+                 search_timeout: float = 8.0,
+                 max_queries: int = 3,
+                 recursion_limit: int = 6,
+                 max_concurrent_runs: int = 4):
+        self.search_fn = search_fn
+        self.cache = cache or SearchCache()
+        self.budget_seconds = budget_seconds
+        self.search_timeout = search_timeout
+        self.max_queries = max_queries
+        self.recursion_limit = recursion_limit
+        self._search_executor = ThreadPoolExecutor(max_workers=max_queries * max_concurrent_runs,
+                                                   thread_name_prefix="web-search")
+        self._agent_executor = ThreadPoolExecutor(max_workers=max_concurrent_runs,
+                                                  thread_name_prefix="web-agent")
+
+        def web_research(queries: List[str]) -> str:
+            """Search the web for several focused queries at once and return the results."""
+            return self.search(queries)
+
+        self.agent = create_react_agent(model=chat_model, tools=[web_research], debug=False)
+
+    def _cached_search(self, query: str) -> str:
+        with span("web_search", "web_search", query=query) as record:
+            results = self.cache.get(query)
+            record.attrs["cached"] = results is not None
+            if results is None:
+                results = self.search_fn(query)
+                self.cache.put(query, results)
+            return results
+
+    def search(self, queries: List[str]) -> str:
+        """Run up to max_queries searches concurrently, keeping those done within search_timeout"""
+        unique: Dict[str, str] = {}
+        for query in queries:
+            if query.strip():
+                unique.setdefault(self.cache.normalize(query), query.strip())
+        queries = list(unique.values())[:self.max_queries]
+        futures = {self._search_executor.submit(in_current_context(self._cached_search), query): query
+                   for query in queries}
+        done, _ = wait(futures, timeout=self.search_timeout)
+        sections = []
+        for future, query in futures.items():
+            if future in done and future.exception() is None:
+                sections.append(f"Results for '{query}':\n{future.result()}")
+            else:
+                sections.append(f"Results for '{query}': search failed or timed out.")
+        return "\n\n".join(sections)
+
+    def start(self, question: str, budget_seconds: Optional[float] = None) -> FallbackRun:
+        """Start researching question in the background and return the run to iterate"""
+        run = FallbackRun(time.monotonic() + (budget_seconds or self.budget_seconds))
+        agent_input = {
+            "messages": [
+                HumanMessage(content=(
+                    f"Research and provide a detailed answer for: '{question}'. "
+                    f"Call web_research once with up to {self.max_queries} focused search queries, "
+                    f"then answer from the results."
+                ))
+            ],
+            "is_last_step": False
+        }
+        tokens = _TokenForwarder(run)
+        config = {"recursion_limit": self.recursion_limit, "callbacks": [tokens]}
+
+        def work():
+            try:
+                # Each update is the output of one node: tool results or a model reply
+                for update in self.agent.stream(agent_input, config=config, stream_mode="updates"):
+                    if run._stop.is_set():
+                        break
+                    for node, output in update.items():
+                        for message in (output or {}).get("messages", []):
+                            if isinstance(message, ToolMessage):
+                                run.findings.append(str(message.content))
+                            elif (node == "agent" and isinstance(message, AIMessage)
+                                  and not message.tool_calls and not tokens.streamed
+                                  and isinstance(message.content, str) and message.content):
+                                run._queue.put(message.content)
+                        if node == "agent":
+                            tokens.streamed = False
+            except Exception as e:
+                run.error = e
+            finally:
+                run._queue.put(_DONE)
+
+        self._agent_executor.submit(in_current_context(work))
+        return run